@@ -1,13 +1,40 @@
+import argparse
 import json
 import os
 import sys
+import time
 import requests as req
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from datetime import timedelta
+from pc_common import RetryPolicy, get_client, map_ordered
 
 api = os.getenv('PRISMA_API_URL')
 username = os.getenv('PRISMA_ACCESS_KEY_ID')
 password = os.getenv('PRISMA_SECRET_KEY')
 intId = os.getenv('PRISMA_INT_ID')
 
+# owner/repository names to onboard, one per line
+INPUT_FILE = 'input.txt'
+
+# Onboarding is sent in chunks of CHUNK_SIZE names, CHUNKS_IN_FLIGHT at a time. The client retries a
+# chunk CHUNK_RETRIES times on timeouts, 429 and 502/503/504; a chunk that still fails is split in half
+# until the failing repository is isolated
+CHUNK_SIZE = 100
+CHUNKS_IN_FLIGHT = 3
+CHUNK_RETRIES = 2
+CHUNK_TIMEOUT = 60
+
+# Longer repository lists are truncated in the console output
+LIST_LIMIT = 50
+MISSING_FILE = 'not_onboarded.txt'
+
+# After submitting, poll the repository list until every accepted repository shows up or WATCH_TIMEOUT
+# seconds pass. The poll interval starts at POLL_INTERVAL and doubles (up to POLL_MAX_INTERVAL) while
+# nothing new appears
+WATCH_TIMEOUT = 1800
+POLL_INTERVAL = 5
+POLL_MAX_INTERVAL = 60
+
 
 class Colors:
     RED = '\033[91m'
@@ -18,85 +45,95 @@ class Colors:
 
 def color_print(text, color):
     print(color + text + Colors.END)
-    
-if api is None or username is None or password is None:
-    color_print("🚨 Attention: It seems some environment variables are missing! Please verify your configuration and try again. 🧐", Colors.YELLOW)
-    sys.exit(1)
 
 
-def authenticate():
+def make_request(method, endpoint, payload=None, cache=True):
     try:
-        payload = {'username': username, 'password': password}
-        headers = {'Content-Type': 'application/json; charset=UTF-8', 'Accept': 'application/json; charset=UTF-8'}
-        result = req.post(f"{api}/login", data=json.dumps(payload), headers=headers, timeout=30)
+        if method not in ("GET", "POST", "PUT"):
+            raise ValueError(f"Unsupported HTTP method: {method}")
+
+        # cache=False bypasses the response cache for this request only (--no-cache)
+        result = get_client().request(method, endpoint, payload, cache=cache)
         result.raise_for_status()
-        return result.json()['token']
+        return result
     except req.exceptions.RequestException as e:
         print(f"Error: {e}")
         sys.exit(1)
 
-def create_headers(token):
-    try:
-        return {'Content-Type': 'application/json; charset=UTF-8', 'Accept': 'application/json; charset=UTF-8',
-                'x-redlock-auth': token}
-    except Exception as e:
-        print(f"Error: {e}")
-        sys.exit(1)
+def read_repositories(file_path=INPUT_FILE):
+    # owner/repository lines, without blanks or duplicates, in file order
+    with open(file_path, 'r') as file:
+        return list(dict.fromkeys(line.strip() for line in file if line.strip()))
 
-def make_request(method, endpoint, payload=None):
+"""
+Onboard one chunk. Transient failures are retried by the client only, up to `retries`
+times; a chunk that is rejected or still failing is split in half and each half onboarded
+on its own, down to single repositories, so one bad name only fails itself.
+Returns (onboarded names, [(name, error), ...])
+"""
+def onboard_chunk(client, chunk, retries=CHUNK_RETRIES):
     try:
-        token = authenticate()  # Assume this function returns a token
-        headers = create_headers(token)  # Assume this function creates the necessary headers
-        
-        if method == "GET":
-            result = req.get(f"{api}/{endpoint}", headers=headers, timeout=30)
-        elif method == "POST":
-            result = req.post(f"{api}/{endpoint}", headers=headers, data=json.dumps(payload), timeout=30)
-        elif method == "PUT":
-            result = req.put(f"{api}/{endpoint}", headers=headers, data=json.dumps(payload), timeout=30)
-        else:
-            raise ValueError(f"Unsupported HTTP method: {method}")
-        
-        result.raise_for_status()
-        return result
+        response = client.post("code/api/v2/repositories", {"integrationId": intId, "repositoriesNames": chunk},
+                               timeout=CHUNK_TIMEOUT, retry=RetryPolicy(retries=retries))
+        if response.ok:
+            return list(chunk), []
+        error = f"{response.status_code} {response.text[:200]}"
     except req.exceptions.RequestException as e:
-        print(f"Error: {e}")
-        sys.exit(1)
+        error = str(e)
+    if len(chunk) == 1:
+        color_print(f"❌ {chunk[0]}: {error}", Colors.RED)
+        return [], [(chunk[0], error)]
+    mid = len(chunk) // 2
+    color_print(f"⚠️  Chunk of {len(chunk)} failed ({error}); splitting into {mid} + {len(chunk) - mid}", Colors.YELLOW)
+    left_ok, left_failed = onboard_chunk(client, chunk[:mid], retries)
+    right_ok, right_failed = onboard_chunk(client, chunk[mid:], retries)
+    return left_ok + right_ok, left_failed + right_failed
 
-def update_integration():
+def update_integration(chunk_size=CHUNK_SIZE, parallel=CHUNKS_IN_FLIGHT, retries=CHUNK_RETRIES, input_file=INPUT_FILE):
     try:
-        color_print("📄 Reading repositories from 'input.txt' for integration...", Colors.CYAN)
-        with open('input.txt', 'r') as file:
-            repositories = [line.strip() for line in file.readlines()]
+        color_print(f"📄 Reading repositories from '{input_file}' for integration...", Colors.CYAN)
+        repositories = read_repositories(input_file)
         if not repositories:
-            color_print("⚠️  No repositories found in 'input.txt'. Integration aborted.", Colors.YELLOW)
+            color_print(f"⚠️  No repositories found in '{input_file}'. Integration aborted.", Colors.YELLOW)
             return
         color_print("🔄 Preparing to integrate the following repositories:", Colors.CYAN)
-        for i, repo in enumerate(repositories, start=1):
+        for i, repo in enumerate(repositories[:LIST_LIMIT], start=1):
             print(f"   {i}. {repo}")
-        payload = {
-        "integrationId": intId,
-        "repositoriesNames": repositories    
-        } 
-        color_print(f"\n🚀 Sending payload to onboard {len(repositories)} repositories...", Colors.GREEN) 
-        response = make_request("POST", f"code/api/v2/repositories", payload)
-        if response.status_code == 202:
-            color_print("✅ Integration updated successfully!", Colors.GREEN)
-        return response
+        if len(repositories) > LIST_LIMIT:
+            print(f"   ... and {len(repositories) - LIST_LIMIT} more")
+
+        chunks = [repositories[i:i + chunk_size] for i in range(0, len(repositories), chunk_size)]
+        color_print(f"\n🚀 Onboarding {len(repositories)} repositories in {len(chunks)} chunks of up to {chunk_size}, "
+                    f"{parallel} at a time...", Colors.GREEN)
+        client = get_client()
+        results = map_ordered(lambda chunk: onboard_chunk(client, chunk, retries), chunks, workers=parallel)
+
+        onboarded = [name for ok, _ in results for name in ok]
+        failed = [entry for _, bad in results for entry in bad]
+        if failed:
+            color_print(f"⚠️  {len(onboarded)} repositories submitted, {len(failed)} rejected:", Colors.YELLOW)
+            for name, error in failed:
+                print(f"   ❌ {name}: {error}")
+        else:
+            color_print(f"✅ Integration updated successfully! {len(onboarded)} repositories submitted.", Colors.GREEN)
+        return {"requested": repositories, "onboarded": onboarded, "failed": failed}
     except FileNotFoundError:
-        color_print("❌ Error: 'input.txt' not found. Please ensure the file exists.", Colors.RED)
+        color_print(f"❌ Error: '{input_file}' not found. Please ensure the file exists.", Colors.RED)
     except Exception as e:
         color_print(f"❌ Error: {e}", Colors.RED)
 
 
-def get_repos():
-    response = make_request("GET", "code/api/v2/repositories")
+def get_repos(show=True, cache=True):
+    response = make_request("GET", "code/api/v2/repositories", cache=cache)
 
     data = response.json()['repositories']
 
     if not data:
         print("No repositories found.")
-        return
+        return []
+
+    if not show:
+        return data
 
     print("Onboarded repositories:")
     for item in data:
@@ -109,19 +146,140 @@ def get_repos():
         print(f"   └── Name: {repo_name}\n")
     
     print("✅ These are the onboarded repositories.")
+    return data
+
+"""
+Diff the requested owner/repository names against the onboarded repositories and write the
+ones not (yet) onboarded to MISSING_FILE. Returns the missing names
+"""
+def reconcile(requested, data):
+    onboarded = onboarded_names(data)
+    missing = [name for name in requested if name not in onboarded]
+    if not missing:
+        color_print(f"✅ Reconciled: all {len(requested)} requested repositories are onboarded.", Colors.GREEN)
+        return missing
+    color_print(f"⚠️  Reconciled: {len(requested) - len(missing)} of {len(requested)} requested repositories are "
+                f"onboarded, {len(missing)} are not (yet).", Colors.YELLOW)
+    for name in missing[:LIST_LIMIT]:
+        print(f"   ⏳ {name}")
+    if len(missing) > LIST_LIMIT:
+        print(f"   ... and {len(missing) - LIST_LIMIT} more")
+    with open(MISSING_FILE, 'w') as f:
+        f.writelines(name + '\n' for name in missing)
+    color_print(f"📝 Missing repositories written to {MISSING_FILE}", Colors.YELLOW)
+    return missing
+
+def onboarded_names(data):
+    return {f"{item.get('owner')}/{item.get('repository')}" for item in data}
+
+"""
+Write the full onboarded repository listing (source, id, owner/repository) to a file
+"""
+def write_listing(data, path):
+    with open(path, 'w') as f:
+        json.dump([{"source": item.get('source'), "id": item.get('id'),
+                    "name": f"{item.get('owner')}/{item.get('repository')}"} for item in data], f, indent=4)
+    color_print(f"📝 {len(data)} onboarded repositories written to {path}", Colors.CYAN)
+
+def format_eta(seconds):
+    return str(timedelta(seconds=int(seconds)))
+
+"""
+Poll the repository list until every expected owner/repository name is onboarded or
+`timeout` seconds pass, printing one aggregated progress line per poll. A failed poll
+counts as no progress. Returns (complete, last repository list)
+"""
+def watch_onboarding(expected, timeout=WATCH_TIMEOUT, interval=POLL_INTERVAL, max_interval=POLL_MAX_INTERVAL):
+    expected = set(expected)
+    client = get_client()
+    started = time.monotonic()
+    deadline = started + timeout
+    data, first_count, last_count, delay = [], None, -1, interval
+    while True:
+        try:
+            # Never from the cache: each poll has to see the current list
+            response = client.get("code/api/v2/repositories", cache=False)
+            response.raise_for_status()
+            data = response.json()['repositories'] or []
+        except (req.exceptions.RequestException, ValueError, KeyError) as e:
+            color_print(f"⚠️  Poll failed: {e}", Colors.YELLOW)
+        count = len(expected & onboarded_names(data))
+        elapsed = time.monotonic() - started
+        if first_count is None:
+            first_count = count
+        rate = (count - first_count) / elapsed if elapsed > 0 else 0
+        remaining = len(expected) - count
+        eta = f", ETA {format_eta(remaining / rate)}" if rate > 0 and remaining else ""
+        print(f"⏳ {count} of {len(expected)} onboarded ({100.0 * count / max(1, len(expected)):.1f}%), "
+              f"{rate * 60:.1f}/min{eta}, elapsed {format_eta(elapsed)}")
+        if not remaining:
+            return True, data
+        now = time.monotonic()
+        if now >= deadline:
+            return False, data
+        # Back off while nothing changes; keep the pace while repositories are still appearing
+        delay = interval if count > last_count else min(max_interval, delay * 2)
+        last_count = count
+        time.sleep(min(delay, deadline - now))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Onboard the repositories listed in input.txt")
+    parser.add_argument('--input', default=INPUT_FILE,
+                        help="owner/repository names to onboard, one per line (default: %(default)s)")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                        help="repositories per onboarding request (default: %(default)s)")
+    parser.add_argument('--parallel', type=int, default=CHUNKS_IN_FLIGHT,
+                        help="chunks in flight at once (default: %(default)s)")
+    parser.add_argument('--retries', type=int, default=CHUNK_RETRIES,
+                        help="client retries of a chunk on timeouts, 429 and 502/503/504 before it is split "
+                             "(default: %(default)s)")
+    parser.add_argument('--no-reconcile', action='store_true',
+                        help="skip the check of requested against onboarded repositories")
+    parser.add_argument('--no-wait', action='store_true',
+                        help="check the repository list once instead of waiting for onboarding to finish")
+    parser.add_argument('--timeout', type=int, default=WATCH_TIMEOUT,
+                        help="seconds to wait for onboarding to finish (default: %(default)s)")
+    parser.add_argument('--list-file', help="write the full onboarded repository listing to this JSON file")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="bypass the PRISMA_HTTP_CACHE response cache and query the API directly")
+    args = parser.parse_args(argv)
+
+    if api is None or username is None or password is None:
+        color_print("🚨 Attention: It seems some environment variables are missing! Please verify your configuration and try again. 🧐", Colors.YELLOW)
+        return 1
 
-if __name__ == '__main__':
     color_print('🎯 CAS - Integrate Multiple Repositories - v0.0.1', Colors.GREEN)
     try:
         # Call the update integration function
         color_print('🔄 Updating integration for repositories...', Colors.CYAN)
-        update_integration()
+        result = update_integration(args.chunk_size, args.parallel, args.retries, args.input)
 
-        # Fetch and print the onboarded repositories
-        color_print('📦 Fetching onboarded repositories:', Colors.CYAN)
-        get_repos()
+        # Onboarding is asynchronous: wait for the accepted repositories to show up, with progress
+        # instead of a per-repository listing
+        complete = True
+        if result and result["onboarded"] and not args.no_wait:
+            color_print(f'📦 Waiting up to {format_eta(args.timeout)} for onboarding to finish...', Colors.CYAN)
+            complete, data = watch_onboarding(result["onboarded"], args.timeout)
+        else:
+            color_print('📦 Fetching onboarded repositories...', Colors.CYAN)
+            data = get_repos(show=False, cache=not args.no_cache)
+        if args.list_file:
+            write_listing(data, args.list_file)
+
+        missing = []
+        if result and not args.no_reconcile:
+            color_print('🔍 Reconciling requested repositories against onboarded ones...', Colors.CYAN)
+            missing = reconcile(result["requested"], data)
 
-        # Indicate that the process is done
+        # Indicate that the process is done; the exit status tells pipelines whether onboarding finished
+        if not result or result["failed"] or missing or not complete:
+            color_print('⚠️  Done, but some repositories are not onboarded. See the messages above.', Colors.YELLOW)
+            return 1
         color_print('✅ Done. All repositories have been onboarded successfully.', Colors.GREEN)
     except Exception as e:
         color_print(f"❌ Error: {e}", Colors.RED)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
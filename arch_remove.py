@@ -1,9 +1,26 @@
+import argparse
+import fnmatch
 import json
 import sys
 import os
+import threading
+import zlib
+from collections import Counter
+from datetime import datetime, timezone
 import requests as req
+from pc_common import TokenBucket, get_client, run_bulk
 
-api = ''
+# Bulk delete tuning: concurrent delete requests, and a requests/second ceiling (retries included)
+DELETE_WORKERS = 8
+DELETE_RATE = 5
+REPORT_FILE = "arch_remove_report.json"
+
+# Dry runs save the plan here; --plan executes a saved plan without querying the API again
+PLAN_FILE = "arch_remove_plan.json"
+# Every delete outcome is appended here; reruns skip repositories the journal already shows as done
+JOURNAL_FILE = "arch_remove_journal.jsonl"
+# Repositories listed when previewing a plan
+PREVIEW_ROWS = 20
 
 """
 Check the result of a restful API call
@@ -14,10 +31,9 @@ def result_ok(result, message):
         result.raise_for_status()
 
 """
-Authenticate against Prisma cloud. Return authentication JWT token
+Authenticate against Prisma cloud. Return the shared API client holding the JWT token
 """
 def auth_prisma():
-    global api
     api = os.getenv('PRISMA_API_URL')
     username = os.getenv('PRISMA_ACCESS_KEY_ID')
     password = os.getenv('PRISMA_SECRET_KEY')
@@ -25,67 +41,168 @@ def auth_prisma():
         print('Missing environment variables')
         sys.exit(1)
 
-    payload = { 'username': username, 'password': password }
-    headers = { 'Content-Type': 'application/json; charset=UTF-8', 'Accept': 'application/json; charset=UTF-8' }
+    client = get_client(api=api, username=username, password=password)
+    client.token  # log in now so bad credentials fail up front
+    return client
+
+"""
+Query the archived repositories (optionally only from some providers) and return the plan items
+"""
+def fetch_archived(client, providers=None):
+    payload = { "filters": { "archived": ["true"]}}
+    if providers:
+        payload["filters"]["providers"] = providers
+
+    # Get all metadata
+    result = client.post("bridgecrew/api/v1/vcs-repository/repositories", payload)
+    result_ok(result,'Could not get archived repository metadata')
+
+    items = []
+    for item in result.json():
+        if item.get('id'):
+            items.append({"id": item.get('id'), "fullName": item.get('fullName'), "source": item.get('source')})
+        else:
+            print("Missing 'id' key in response item:", item)
+    return items
+
+"""
+Save a plan so it can be reviewed, then executed (or split across runners) without re-querying
+"""
+def save_plan(path, items, filters):
+    plan = {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "filters": filters,
+        "counts": provider_counts(items),
+        "repositories": items,
+    }
+    with open(path, 'w') as f:
+        json.dump(plan, f, indent=4)
 
-    result = req.post(f"{api}/login", data=json.dumps(payload), headers=headers)
-    result_ok(result,'Could not authenticate to Prisma.')
+def load_plan(path):
+    with open(path, 'r') as f:
+        return json.load(f)["repositories"]
 
-    return result.json()['token']
+def filter_plan(items, providers=None, pattern=None):
+    if providers:
+        wanted = {p.lower() for p in providers}
+        items = [item for item in items if (item.get('source') or '').lower() in wanted]
+    if pattern:
+        items = [item for item in items if fnmatch.fnmatch(item.get('fullName') or '', pattern)]
+    return items
 
 """
-Renews existing token. Returns new token to use.
+Keep shard `index` of `count`. Repositories are assigned by a stable hash of their id,
+so every runner given the same plan gets a disjoint share
 """
-def extend_token(mytoken):
-    headers =  {'Accept': 'application/json; charset=UTF-8','x-redlock-auth': mytoken}
-    result = req.get(f"{api}/auth_token/extend", headers=headers)
-    result_ok(result, 'Could not extend current token.')
-    return result.json()['token']
+def shard_plan(items, index, count):
+    return [item for item in items if zlib.crc32(str(item['id']).encode()) % count == index]
+
+def parse_shard(value):
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError("shard must look like INDEX/COUNT, e.g. 0/4")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError("shard index must be between 0 and COUNT-1")
+    return index, count
+
+def provider_counts(items):
+    return dict(Counter(item.get('source') or 'unknown' for item in items).most_common())
+
+def print_plan(items, preview):
+    print(f"Plan: {len(items)} archived repositories")
+    for provider, count in provider_counts(items).items():
+        print(f"  {provider}: {count}")
+    for item in items[:preview]:
+        print(f"  - {item['fullName']} ({item.get('source')}, id {item['id']})")
+    if len(items) > preview:
+        print(f"  ... and {len(items) - preview} more")
 
 """
-Create headers for the RESTful API calls, returns a headers object.
+IDs the journal records as done: deleted, or already gone (404)
 """
-def create_headers(token):
-    return { 'Content-Type': 'application/json; charset=UTF-8', 'Accept': 'application/json; charset=UTF-8','x-redlock-auth': token}
+def journal_done(path):
+    done = set()
+    if not path or not os.path.exists(path):
+        return done
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # a line cut short by an interrupted run
+            if entry.get('ok') or entry.get('status') == 404:
+                done.add(entry['id'])
+    return done
+
+class Journal:
+    """Append-only JSON Lines log of delete outcomes, flushed per entry so an interrupted run loses nothing."""
 
+    def __init__(self, path):
+        self._file = open(path, 'a') if path else None
+        self._lock = threading.Lock()
 
-def get_ids_and_delete():
+    def append(self, entry, ok):
+        if self._file is None:
+            return
+        line = json.dumps({**entry, "ok": ok, "time": datetime.now(timezone.utc).isoformat()})
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+"""
+Delete one repository; the response is checked by the bulk runner. `limiter` throttles
+the deletes (retries included) without touching the shared client's own limiter
+"""
+def delete_repository(client, item, limiter=None):
+    return client.delete(f"bridgecrew/api/v2/repositories/{item['id']}", limiter=limiter)
+
+"""
+Print the outcome of each delete as it completes
+"""
+def print_result(entry, ok):
+    retried = f" after {entry['retries']} retries" if entry.get('retries') else ""
+    if ok:
+        print(f"Successfully deleted item with id '{entry['id']}' and full name '{entry['fullName']}'{retried}")
+    else:
+        print(f"Failed to delete item with id '{entry['id']}' and full name '{entry['fullName']}'{retried}: "
+              f"{entry.get('status')} {entry.get('error', '')}")
+
+def get_ids_and_delete(client, items, workers=DELETE_WORKERS, rate=DELETE_RATE, report_file=REPORT_FILE,
+                       journal_file=JOURNAL_FILE):
     try:
-        # Make the first API call to retrieve data
-        token = auth_prisma()
-        headers = create_headers(token)
-        payload = { "filters": { "archived": ["true"]}}
-        # payload = { "filters": { "archived": ["true"], "providers":["Github"] }}
-
-        # Get all metadata
-        result = req.post(f"{api}/bridgecrew/api/v1/vcs-repository/repositories", headers=headers, data=json.dumps(payload))
-        result_ok(result,'Could not get archived repository metadata')
-        
-        # Initialize list to store deleted ids
-        deleted_ids = []
-        
-        # Process response data
-        for item in result.json():
-            id_key = item.get('id')
-            full_name = item.get('fullName')
-            if id_key:
-                # Construct URL for delete request
-                # Make the delete request
-                delete_response = req.delete(f"{api}/bridgecrew/api/v2/repositories/{id_key}", headers=headers)
-                delete_response.raise_for_status()  # Raise exception for HTTP errors
-                
-                # Check if deletion was successful
-                if delete_response.status_code == 202:
-                    print(f"Successfully deleted item with id '{id_key}' and full name '{full_name}'")
-                    deleted_ids.append({"id": id_key, "fullName": full_name})
-                else:
-                    print(f"Failed to delete item with id '{id_key}' and full name '{full_name}'")
-            else:
-                print("Missing 'id' key in response item:", item)
-        
-        # Return the list of deleted ids
-        return deleted_ids
-    
+        print(f"Deleting {len(items)} archived repositories with {workers} workers at up to {rate} requests/second")
+
+        # Deletes run on a bounded pool; every delete request (retries included) goes through the rate
+        # limiter, and a failed delete is recorded in the report instead of stopping the run
+        limiter = TokenBucket(rate)
+        journal = Journal(journal_file)
+
+        def on_result(entry, ok):
+            journal.append(entry, ok)
+            print_result(entry, ok)
+
+        try:
+            report = run_bulk(lambda item: delete_repository(client, item, limiter), items, "delete archived repositories",
+                              workers=workers, describe=lambda item: item, on_result=on_result)
+        finally:
+            journal.close()
+
+        summary = report.summary()
+        print(f"Deleted {summary['succeeded']} of {summary['total']} repositories, {summary['failed']} failed, "
+              f"{summary['retried']} needed retries ({summary['elapsed']}s)")
+        if report_file:
+            report.write(report_file)
+            print(f"Report written to {report_file}")
+
+        # Return the deleted ids and the failed entries
+        deleted = [{"id": entry['id'], "fullName": entry['fullName']} for entry in report.succeeded]
+        return deleted, report.failed
+
     except req.RequestException as e:
         print("Error making HTTP request:", e)
         return None
@@ -93,9 +210,64 @@ def get_ids_and_delete():
         print("An error occurred:", e)
         return None
 
-# Example usage
-deleted_ids = get_ids_and_delete()
-if deleted_ids:
-    print("Deleted IDs:", deleted_ids)
-else:
-    print("No IDs were deleted.")
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Delete archived repositories from Prisma Cloud")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="build and preview the plan, save it to --save-plan, and delete nothing")
+    parser.add_argument('--plan', help="execute a saved plan instead of querying the API")
+    parser.add_argument('--save-plan', default=PLAN_FILE, help="where a dry run saves the plan (default: %(default)s)")
+    parser.add_argument('--provider', action='append',
+                        help="only repositories from this provider, e.g. Github (repeatable)")
+    parser.add_argument('--match', help="only repositories whose full name matches this glob, e.g. 'my-org/*'")
+    parser.add_argument('--shard', type=parse_shard, help="only shard INDEX of COUNT, e.g. 0/4")
+    parser.add_argument('--preview', type=int, default=PREVIEW_ROWS,
+                        help="repositories listed in the plan preview (default: %(default)s)")
+    parser.add_argument('--journal', default=JOURNAL_FILE,
+                        help="append-only outcome log; repositories it shows as done are skipped (default: %(default)s)")
+    parser.add_argument('--workers', type=int, default=DELETE_WORKERS,
+                        help="concurrent delete requests (default: %(default)s)")
+    parser.add_argument('--rate', type=float, default=DELETE_RATE,
+                        help="requests per second ceiling, retries included (default: %(default)s)")
+    parser.add_argument('--report', default=REPORT_FILE,
+                        help="JSON report of succeeded, failed and retried deletes (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    try:
+        client = None if args.dry_run and args.plan else auth_prisma()
+        items = load_plan(args.plan) if args.plan else fetch_archived(client, args.provider)
+    except (req.RequestException, OSError, ValueError, KeyError) as e:
+        print("Could not build the deletion plan:", e)
+        return 1
+
+    items = filter_plan(items, args.provider, args.match)
+    if args.shard:
+        items = shard_plan(items, *args.shard)
+        print(f"Shard {args.shard[0]}/{args.shard[1]}")
+
+    done = journal_done(args.journal)
+    if done:
+        remaining = [item for item in items if item['id'] not in done]
+        print(f"Skipping {len(items) - len(remaining)} repositories already done according to {args.journal}")
+        items = remaining
+
+    print_plan(items, args.preview)
+    if args.dry_run:
+        save_plan(args.save_plan, items, {"providers": args.provider, "match": args.match,
+                                          "shard": "/".join(map(str, args.shard)) if args.shard else None})
+        print(f"Dry run: nothing deleted. Plan written to {args.save_plan}")
+        return 0
+    if not items:
+        print("Nothing to delete.")
+        return 0
+
+    result = get_ids_and_delete(client, items, args.workers, args.rate, args.report, args.journal)
+    deleted_ids, failed = result if result is not None else ([], None)
+    if deleted_ids:
+        print("Deleted IDs:", deleted_ids)
+    else:
+        print("No IDs were deleted.")
+    # Non-zero when the run broke off or any delete failed, so scripted runs notice partial failures
+    return 0 if failed == [] else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,10 +1,17 @@
+import argparse
 import json
 import sys
 import csv
 import os
-import requests as req
+from pc_common import Paginator, get_client
 
-api = ''
+GRAPHQL_ENDPOINT = "bridgecrew/api/v1/assets/graphql"
+GRAPHQL_TIMEOUT = 60
+# CI instances per GraphQL query, and queries in flight at once
+INSTANCE_PAGE_SIZE = 25
+PAGE_WINDOW = 4
+OUTPUT_FILE = 'output.csv'
+CSV_HEADERS = ["Plugin Name", "Version", "IsEnabled", "Installed on", "Vulnerabilities", "Highest severity"]
 
 """
 Check the result of a restful API call
@@ -15,10 +22,9 @@ def result_ok(result, message):
         result.raise_for_status()
 
 """
-Authenticate against Prisma cloud. Return authentication JWT token
+Authenticate against Prisma cloud. Return the shared API client holding the JWT token
 """
 def auth_prisma():
-    global api
     api = os.getenv('PRISMA_API_URL')
     username = os.getenv('PRISMA_ACCESS_KEY_ID')
     password = os.getenv('PRISMA_SECRET_KEY')
@@ -27,107 +33,200 @@ def auth_prisma():
         print('Missing environment variables')
         sys.exit(1)
 
-    payload = { 'username': username, 'password': password }
-    headers = { 'Content-Type': 'application/json; charset=UTF-8', 'Accept': 'application/json; charset=UTF-8' }
+    client = get_client(api=api, username=username, password=password)
+    client.token  # log in now so bad credentials fail up front
+    return client
 
-    result = req.post(f"{api}/login", data=json.dumps(payload), headers=headers, timeout=5)
-    result_ok(result,'Could not authenticate to Prisma.')
-
-    return result.json()['token']
-
-"""
-Renews existing token. Returns new token to use.
-"""
-def extend_token(mytoken):
-    headers =  {'Accept': 'application/json; charset=UTF-8','x-redlock-auth': mytoken}
-    result = req.get(f"{api}/auth_token/extend", headers=headers, timeout=5)
-    result_ok(result, 'Could not extend current token.')
-    return result.json()['token']
-
-"""
-Create headers for the RESTful API calls, returns a headers object.
-"""
-def create_headers(token):
-    return { 'Content-Type': 'application/json; charset=UTF-8', 'Accept': 'application/json; charset=UTF-8','x-redlock-auth': token}
-
-"""
-Retrieve CAS Assets Raw Meta Data
-"""
-def get_cas_assets():
-    token = auth_prisma()
-    headers = create_headers(token)
-    payload = json.dumps({
-    "query": f"""
-    {{
-        ciInstances(where: {{ customerName: "{os.getenv('PRISMA_ID')}" }}) {{
-            ciPlugins {{
+# Plugin fields fetched for every CI instance
+PLUGIN_FIELDS = """
+            ciPlugins {
                 shortName
                 version
                 longName
                 isEnabled
-                ciInstancesAggregate {{
+                ciInstancesAggregate {
                     count
-                }}
-                ciInstances {{
+                }
+                ciInstances {
                     name
-                }}
-                jenkinsVulnerabilities {{
+                }
+                jenkinsVulnerabilities {
                     name
                     url
                     vulnerabilityId
-                    scores {{
+                    scores {
                         cve
                         cvssScore
                         cveDetailed
-                    }}
-                }}
-            }}
+                    }
+                }
+            }
+"""
+
+"""
+Run a GraphQL query against the assets endpoint and return its data
+"""
+def graphql(client, query):
+    result = client.post(GRAPHQL_ENDPOINT, data=json.dumps({"query": query}), timeout=GRAPHQL_TIMEOUT)
+    result_ok(result,'Could not get asset information.')
+    body = result.json()
+    if body.get("errors"):
+        raise Exception(f"GraphQL errors: {body['errors']}")
+    return body["data"]
+
+def customer_filter():
+    return f"{{ customerName: {json.dumps(os.getenv('PRISMA_ID'))} }}"
+
+"""
+Number of CI instances, or None when the count can't be queried (pages are then read until one comes back empty)
+"""
+def count_ci_instances(client):
+    try:
+        data = graphql(client, f"{{ ciInstancesAggregate(where: {customer_filter()}) {{ count }} }}")
+        return int(data["ciInstancesAggregate"]["count"])
+    except Exception as e:
+        print(f"Could not count CI instances ({e}); paging until an empty page")
+        return None
+
+"""
+One page of CI instances (with their plugins), in a stable order so pages don't overlap
+"""
+def fetch_ci_instances(client, index, size):
+    print(f"Fetching CI instances {index * size + 1} to {index * size + size}...")
+    data = graphql(client, f"""
+    {{
+        ciInstances(where: {customer_filter()}, options: {{ limit: {size}, offset: {index * size}, sort: [{{ name: ASC }}] }}) {{
+            name
+{PLUGIN_FIELDS}
         }}
     }}
-    """
-})
-    
-    819313206748390400
+    """)
+    return data["ciInstances"] or []
 
-    # Get all build policies
-    result = req.post(f"{api}/bridgecrew/api/v1/assets/graphql", headers=headers, data=payload, timeout=30)
-    result_ok(result,'Could not get asset information.')
-    json_to_csv(result.json()["data"])
+"""
+Retrieve CAS Assets Raw Meta Data
+"""
+def get_cas_assets(page_size=INSTANCE_PAGE_SIZE, window=PAGE_WINDOW, output_file=OUTPUT_FILE, per_instance=False):
+    client = auth_prisma()
+
+    if not page_size:
+        # Single query for the whole customer
+        data = graphql(client, f"{{ ciInstances(where: {customer_filter()}) {{ name {PLUGIN_FIELDS} }} }}")
+        json_to_csv(data, output_file, per_instance)
+        return
 
+    # CI instances are fetched a page at a time, `window` pages in flight, and each page is processed
+    # as soon as it arrives, so memory stays bounded by the page size (plus the rollup)
+    total = count_ci_instances(client)
+    if total is not None:
+        print(f"Total CI instances: {total}")
+    pages = Paginator(lambda index, size: fetch_ci_instances(client, index, size),
+                      page_size=page_size, window=window, total=total)
+    write_csv(pages, output_file, per_instance)
 
 
-def json_to_csv(data):
-    headers = ["Plugin Name", "Version", "IsEnabled", "Installed on", "Vulnerabilities", "Highest severity"]
-    rows = []
-    
-    for ci_instance in data["ciInstances"]:
+"""
+CVE IDs and the highest CVSS score of a plugin version, over every score of every vulnerability.
+A plugin version's vulnerabilities are the same on every CI instance it is installed on, so
+`cache` ({(shortName, version): summary}, kept by the caller for one export) works them out once
+"""
+def vulnerability_summary(plugin, cache=None):
+    key = (plugin.get("shortName"), plugin.get("version"))
+    summary = cache.get(key) if cache is not None else None
+    if summary is None:
+        cves, highest_severity = [], 0.0
+        for vulnerability in plugin.get("jenkinsVulnerabilities") or []:
+            for score in vulnerability.get("scores") or []:
+                if score.get("cve") and score["cve"] not in cves:
+                    cves.append(score["cve"])
+                if score.get("cvssScore") is not None:
+                    highest_severity = max(highest_severity, float(score["cvssScore"]))
+        summary = (cves, highest_severity)
+        if cache is not None:
+            cache[key] = summary
+    return summary
+
+def instance_names(ci_instance, plugin):
+    # The CI instance the plugin was listed under, plus every instance the plugin reports itself
+    names = [ci_instance["name"]] if ci_instance.get("name") else []
+    names += [i["name"] for i in plugin.get("ciInstances") or [] if i.get("name")]
+    return list(dict.fromkeys(names))
+
+"""
+Per-instance view: one CSV row per (CI instance, plugin)
+"""
+def plugin_rows(ci_instances, vulnerabilities=None):
+    for ci_instance in ci_instances:
         for plugin in ci_instance["ciPlugins"]:
-            long_name = plugin["longName"]
-            version = plugin["version"]
-            try:
-                is_enabled = plugin["isEnabled"]
-            except NameError:
-                is_enabled = True
-            ci_instances = ci_instance["ciPlugins"][0]["ciInstances"][0]["name"] 
-            jenkins_vulnerabilities = plugin["jenkinsVulnerabilities"]
-            vulnerabilities = []
-            highest_severity = 0.0
-            for vulnerability in jenkins_vulnerabilities:
-                vulnerability_id = vulnerability["scores"][0]["cve"]
-                vulnerability_severity = vulnerability["scores"][0]["cvssScore"]
-                vulnerabilities.append(vulnerability_id)
-                highest_severity = max(highest_severity, vulnerability_severity)
-            
-            row = [long_name, version, is_enabled, ci_instances, ','.join(vulnerabilities), highest_severity]
-            rows.append(row)
-    
-    with open('output.csv', 'w', newline='') as file:
+            cves, highest_severity = vulnerability_summary(plugin, vulnerabilities)
+            names = instance_names(ci_instance, plugin)
+            yield [plugin["longName"], plugin["version"], plugin.get("isEnabled", True), names[0] if names else "",
+                   ','.join(cves), highest_severity]
+
+class PluginRollup:
+    """One entry per (shortName, version), collecting every CI instance the plugin version is installed on."""
+
+    def __init__(self):
+        self.plugins = {}
+
+    def add(self, ci_instances):
+        for ci_instance in ci_instances:
+            for plugin in ci_instance["ciPlugins"]:
+                key = (plugin.get("shortName"), plugin.get("version"))
+                entry = self.plugins.get(key)
+                if entry is None:
+                    entry = self.plugins[key] = {"plugin": plugin, "enabled": set(), "instances": {}}
+                entry["enabled"].add(plugin.get("isEnabled", True))
+                entry["instances"].update(dict.fromkeys(instance_names(ci_instance, plugin)))
+
+    def rows(self):
+        # Each plugin version is one entry, so its vulnerabilities are worked out once without a cache
+        for entry in self.plugins.values():
+            plugin = entry["plugin"]
+            cves, highest_severity = vulnerability_summary(plugin)
+            enabled = next(iter(entry["enabled"])) if len(entry["enabled"]) == 1 else "Mixed"
+            yield [plugin["longName"], plugin["version"], enabled, ','.join(entry["instances"]),
+                   ','.join(cves), highest_severity]
+
+"""
+Write the plugin CSV from batches of CI instances: rolled up per plugin version, or (per_instance)
+one row per CI instance and plugin, streamed as the batches arrive
+"""
+def write_csv(batches, output_file=OUTPUT_FILE, per_instance=False):
+    with open(output_file, 'w', newline='') as file:
         writer = csv.writer(file)
-        writer.writerow(headers)
-        writer.writerows(rows)
+        writer.writerow(CSV_HEADERS)
+        rollup = PluginRollup()
+        vulnerabilities = {}  # for this export only
+        for batch in batches:
+            if per_instance:
+                writer.writerows(plugin_rows(batch, vulnerabilities))
+                file.flush()
+            else:
+                rollup.add(batch)
+        if not per_instance:
+            writer.writerows(rollup.rows())
+            print(f"{len(rollup.plugins)} plugin versions")
 
+def json_to_csv(data, output_file=OUTPUT_FILE, per_instance=False):
+    write_csv([data["ciInstances"]], output_file, per_instance)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export CAS CI plugin assets to CSV")
+    parser.add_argument('--page-size', type=int, default=INSTANCE_PAGE_SIZE,
+                        help="CI instances per GraphQL query; 0 sends a single query (default: %(default)s)")
+    parser.add_argument('--window', type=int, default=PAGE_WINDOW,
+                        help="queries in flight at once (default: %(default)s)")
+    parser.add_argument('--output', default=OUTPUT_FILE, help="CSV file (default: %(default)s)")
+    parser.add_argument('--per-instance', action='store_true',
+                        help="one row per CI instance and plugin instead of one row per plugin version")
+    args = parser.parse_args(argv)
 
-if __name__ == '__main__':
     print('Get CAS Assets Raw Meta Data -  0.0.1')
-    get_cas_assets()
-    print('Executed Successfully, check your output.csv')
+    get_cas_assets(args.page_size, args.window, args.output, args.per_instance)
+    print(f'Executed Successfully, check your {args.output}')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,33 @@
+import importlib
+
+from .bulk import BulkReport, run_bulk
+from .checkpoint import Checkpoint
+from .client import PrismaClient, get_client, set_client, result_ok
+from .concurrency import Throughput, map_ordered, percentile
+from .jsonstream import JsonSink, iter_records
+from .paginate import PageFetchError, Paginator
+from .projection import Projection
+from .ratelimit import TokenBucket
+from .retry import EndpointStats, RetryPolicy
+
+# Exports whose modules are only imported on first use, so a script that needs neither
+# columnar output nor the response cache doesn't pay for them (pyarrow, sqlite3)
+_LAZY = {
+    'ColumnarSink': 'columnar',
+    'columnar_available': 'columnar',
+    'ResponseCache': 'httpcache',
+}
+
+
+def __getattr__(name):
+    if name not in _LAZY:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{_LAZY[name]}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+__all__ = ['BulkReport', 'run_bulk', 'Checkpoint', 'PrismaClient', 'get_client', 'set_client', 'result_ok',
+           'Throughput', 'map_ordered', 'percentile',
+           'ColumnarSink', 'columnar_available', 'JsonSink', 'iter_records',
+           'PageFetchError', 'Paginator', 'Projection', 'ResponseCache', 'TokenBucket', 'EndpointStats', 'RetryPolicy']
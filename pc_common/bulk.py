@@ -0,0 +1,77 @@
+import json
+import threading
+import time
+
+from .concurrency import map_ordered
+
+
+class BulkReport:
+    """Thread-safe record of a bulk run: which items succeeded, which failed and which needed retries."""
+
+    def __init__(self, operation):
+        self.operation = operation
+        self.succeeded = []
+        self.failed = []
+        self.retried = []
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def record(self, entry, ok):
+        with self._lock:
+            (self.succeeded if ok else self.failed).append(entry)
+            if entry.get('retries'):
+                self.retried.append(entry)
+
+    def summary(self):
+        with self._lock:
+            return {
+                'operation': self.operation,
+                'total': len(self.succeeded) + len(self.failed),
+                'succeeded': len(self.succeeded),
+                'failed': len(self.failed),
+                'retried': len(self.retried),
+                'elapsed': round(time.monotonic() - self.started, 2),
+            }
+
+    def write(self, path):
+        report = {'summary': self.summary(), 'succeeded': self.succeeded, 'failed': self.failed,
+                  'retried': self.retried}
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=4)
+
+
+def run_bulk(action, items, operation, workers=8, limiter=None, describe=None, on_result=None):
+    """
+    Apply `action` to every item on a bounded thread pool and return a BulkReport.
+
+    `action(item)` returns a response; the item succeeded when response.ok. Errors are
+    isolated per item: an HTTP error or an exception is recorded and the run moves on.
+    `describe(item)` gives the dict stored in the report for the item; each entry also
+    gets the status code, the number of retries the client needed and the error.
+    `on_result(entry, ok)` is called after each item (one at a time), e.g. to print progress.
+    """
+    report = BulkReport(operation)
+    output_lock = threading.Lock()
+
+    def run_one(item):
+        entry = dict(describe(item)) if describe else {'item': item}
+        try:
+            response = action(item)
+            ok = response.ok
+            entry['status'] = response.status_code
+            entry['retries'] = getattr(response, 'retries', 0)
+            if not ok:
+                entry['error'] = (response.text or response.reason or '')[:500]
+        except Exception as e:
+            ok = False
+            entry['status'] = None
+            entry['retries'] = 0
+            entry['error'] = str(e)
+        report.record(entry, ok)
+        if on_result is not None:
+            # Serialised so progress lines from different workers don't interleave
+            with output_lock:
+                on_result(entry, ok)
+
+    map_ordered(run_one, items, workers=workers, limiter=limiter)
+    return report
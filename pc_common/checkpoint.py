@@ -0,0 +1,39 @@
+import json
+import os
+
+
+class Checkpoint:
+    """
+    Small JSON state file for resumable workflows.
+
+    Every save() writes to a temporary file and renames it over the old one, so an
+    interrupted run never leaves a half-written checkpoint behind.
+    """
+
+    def __init__(self, path, state=None):
+        self.path = path
+        self.state = state or {}
+
+    @classmethod
+    def load(cls, path):
+        if not os.path.exists(path):
+            return cls(path)
+        with open(path, 'r') as f:
+            return cls(path, json.load(f))
+
+    def get(self, key, default=None):
+        return self.state.get(key, default)
+
+    def update(self, key, **values):
+        self.state.setdefault(key, {}).update(values)
+        self.save()
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.path)
+
+    def reset(self):
+        self.state = {}
+        self.save()
@@ -0,0 +1,283 @@
+import base64
+import json
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests as req
+from requests.adapters import HTTPAdapter
+
+from .retry import EndpointStats, RetryPolicy, endpoint_key
+
+DEFAULT_TIMEOUT = 30
+DEFAULT_POOL_SIZE = 10
+# Prisma JWTs are valid for 10 minutes; refresh a minute before they lapse.
+DEFAULT_TOKEN_TTL = 600
+TOKEN_REFRESH_MARGIN = 60
+
+JSON_HEADERS = {'Content-Type': 'application/json; charset=UTF-8', 'Accept': 'application/json; charset=UTF-8'}
+
+
+"""
+Check the result of a restful API call
+"""
+def result_ok(result, message):
+    if ( not result.ok ):
+        print(message)
+        result.raise_for_status()
+
+
+"""
+Read the expiry (epoch seconds) out of a JWT, falling back to a fixed TTL.
+"""
+def token_expiry(token, default_ttl=DEFAULT_TOKEN_TTL):
+    try:
+        claims = token.split('.')[1]
+        claims += '=' * (-len(claims) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(claims))['exp'])
+    except Exception:
+        return time.time() + default_ttl
+
+
+class PrismaClient:
+    """
+    Pooled, keep-alive session against the Prisma API.
+
+    The JWT is fetched once, cached for its lifetime and renewed through
+    /auth_token/extend shortly before it expires. Safe to share between threads.
+
+    `timeout` is enforced by the transport (a number, or a (connect, read) tuple).
+    Timeouts, connection errors and retryable statuses are retried according to
+    `retry` (pass retry=None to disable); `stats` counts requests, retries, timeouts
+    and errors per endpoint. Each returned response carries `retries`, the number of
+    retries it took. `limiter` (a TokenBucket) is acquired before every attempt, so it
+    caps the request rate including retries. A single request can also pass its own
+    `limiter`, acquired in addition to the client's, to throttle one job without
+    slowing down everything else that shares the client, and its own `retry` policy in
+    place of the client's.
+
+    `cache` (a ResponseCache) serves read-only listings from disk; pass cache=False to
+    a single request to bypass it, e.g. when polling for a change.
+    """
+
+    def __init__(self, api, username, password, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT,
+                 refresh_margin=TOKEN_REFRESH_MARGIN, retry=RetryPolicy(), verify=True, limiter=None,
+                 cache=None):
+        self.api = api.rstrip('/')
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self.refresh_margin = refresh_margin
+        self.retry = retry or RetryPolicy(retries=0)
+        self.stats = EndpointStats()
+        self.limiter = limiter
+        self.cache = cache
+
+        self.session = req.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update(JSON_HEADERS)
+        self.session.verify = verify
+
+        self._token = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    @classmethod
+    def from_env(cls, api=None, username=None, password=None, **kwargs):
+        api = api or os.getenv('PRISMA_API_URL')
+        username = username or os.getenv('PRISMA_ACCESS_KEY_ID')
+        password = password or os.getenv('PRISMA_SECRET_KEY')
+        if api is None or username is None or password is None:
+            raise ValueError('Missing environment variables')
+        kwargs.setdefault('pool_size', int(os.getenv('PRISMA_POOL_SIZE', DEFAULT_POOL_SIZE)))
+        if os.getenv('PRISMA_HTTP_CACHE') and 'cache' not in kwargs:
+            from .httpcache import ResponseCache
+            kwargs['cache'] = ResponseCache(os.getenv('PRISMA_HTTP_CACHE'))
+        return cls(api, username, password, **kwargs)
+
+    @classmethod
+    def from_credentials_file(cls, path, alias=None, **kwargs):
+        """Build a client from a pcpi-style credentials.json (a list of {alias, url, identity, secret})."""
+        with open(path, 'r') as f:
+            entries = json.load(f)
+        if isinstance(entries, dict):
+            entries = [entries]
+        entry = next((e for e in entries if alias is None or e.get('alias') == alias), None)
+        if entry is None:
+            raise ValueError(f"No credentials for alias '{alias}' in {path}")
+        kwargs.setdefault('verify', entry.get('verify', True))
+        return cls(entry['url'], entry['identity'], entry['secret'], **kwargs)
+
+    def url(self, endpoint):
+        if endpoint.startswith(('http://', 'https://')):
+            return endpoint
+        return f"{self.api}/{endpoint.lstrip('/')}"
+
+    def _set_token(self, token):
+        self._token = token
+        self._expires_at = token_expiry(token)
+
+    def login(self):
+        payload = {'username': self.username, 'password': self.password}
+        result = self.session.post(self.url('login'), data=json.dumps(payload), timeout=self.timeout)
+        result_ok(result, 'Could not authenticate to Prisma.')
+        self._set_token(result.json()['token'])
+        return self._token
+
+    def extend_token(self):
+        headers = {'x-redlock-auth': self._token}
+        result = self.session.get(self.url('auth_token/extend'), headers=headers, timeout=self.timeout)
+        result_ok(result, 'Could not extend current token.')
+        self._set_token(result.json()['token'])
+        return self._token
+
+    @property
+    def token(self):
+        with self._lock:
+            if self._token is None:
+                return self.login()
+            if time.time() >= self._expires_at - self.refresh_margin:
+                try:
+                    return self.extend_token()
+                except req.exceptions.RequestException:
+                    return self.login()
+            return self._token
+
+    def invalidate(self, token):
+        # Only drop the token if nobody has refreshed it in the meantime.
+        with self._lock:
+            if self._token == token:
+                self._token = None
+
+    def headers(self):
+        return {**JSON_HEADERS, 'x-redlock-auth': self.token}
+
+    def request(self, method, endpoint, payload=None, cache=True, limiter=None, retry=None, **kwargs):
+        """Send a request and return the raw response; callers decide how to check it."""
+        if payload is not None:
+            kwargs['data'] = json.dumps(payload)
+        kwargs.setdefault('timeout', self.timeout)
+        extra_headers = kwargs.pop('headers', None) or {}
+        url = self.url(endpoint)
+        key = endpoint_key(method, url)
+        path = urlsplit(url).path.strip('/')
+
+        ttl = self.cache.ttl(method, path) if self.cache and cache else None
+        if ttl is None:
+            result = self._send(method, url, key, extra_headers, kwargs, limiter, retry)
+            if self.cache and method.upper() not in ('GET', 'HEAD') and result.ok:
+                self.cache.invalidate(path, method)
+            return result
+
+        cache_key = self.cache.key(method, url, kwargs.get('data'), self.username)
+        # One fetch per cache key at a time: concurrent callers wait for the first and get its cached copy
+        with self._lock:
+            flight = self._flights.setdefault(cache_key, threading.Lock())
+        with flight:
+            entry = self.cache.lookup(cache_key)
+            if entry is not None and entry['age'] < ttl:
+                self.stats.incr(key, 'cached')
+                result = self.cache.response(entry, url)
+                result.retries = 0
+                return result
+            if entry is not None:
+                extra_headers = {**self.cache.validators(entry), **extra_headers}
+
+            result = self._send(method, url, key, extra_headers, kwargs, limiter, retry)
+
+            if result.status_code == 304 and entry is not None:
+                # Revalidated: the cached body is still current
+                self.cache.refresh(cache_key)
+                self.stats.incr(key, 'cached')
+                retries, result = result.retries, self.cache.response(entry, url)
+                result.retries = retries
+            elif result.status_code == 200:
+                self.cache.store(cache_key, path, result)
+            return result
+
+    def _send(self, method, url, key, extra_headers, kwargs, limiter=None, retry=None):
+        retry = retry or self.retry
+        attempt, reauthenticated = 0, False
+        while True:
+            token = self.token
+            for bucket in (self.limiter, limiter):
+                if bucket is not None:
+                    bucket.acquire()
+            self.stats.incr(key, 'requests')
+            try:
+                result = self.session.request(method, url, headers={'x-redlock-auth': token, **extra_headers}, **kwargs)
+            except (req.exceptions.Timeout, req.exceptions.ConnectionError) as e:
+                self.stats.incr(key, 'timeouts' if isinstance(e, req.exceptions.Timeout) else 'errors')
+                if not retry.should_retry(attempt):
+                    raise
+                self.stats.incr(key, 'retries')
+                time.sleep(retry.delay(attempt))
+                attempt += 1
+                continue
+            if result.status_code == 401 and not reauthenticated:
+                # Token was revoked server side; log in again and retry once.
+                self.invalidate(token)
+                reauthenticated = True
+                continue
+            if result.status_code >= 400 and retry.should_retry(attempt, result):
+                self.stats.incr(key, 'retries')
+                time.sleep(retry.delay(attempt, result))
+                attempt += 1
+                continue
+            if result.status_code >= 400:
+                self.stats.incr(key, 'errors')
+            result.retries = attempt
+            return result
+
+    def get(self, endpoint, **kwargs):
+        return self.request('GET', endpoint, **kwargs)
+
+    def post(self, endpoint, payload=None, **kwargs):
+        return self.request('POST', endpoint, payload, **kwargs)
+
+    def put(self, endpoint, payload=None, **kwargs):
+        return self.request('PUT', endpoint, payload, **kwargs)
+
+    def delete(self, endpoint, **kwargs):
+        return self.request('DELETE', endpoint, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+"""
+Return the process-wide client, creating it from the environment on first use. Only
+the first call configures it: later calls get the same client whatever they pass, and
+a warning is logged when their api, username or password differ from its own.
+"""
+def get_client(**kwargs):
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = PrismaClient.from_env(**kwargs)
+        elif kwargs:
+            wanted = {'api': (kwargs.get('api') or '').rstrip('/') or None,
+                      'username': kwargs.get('username'), 'password': kwargs.get('password')}
+            ignored = [name for name, value in wanted.items()
+                       if value is not None and value != getattr(_client, name)]
+            if ignored:
+                logging.warning(f"The shared Prisma client already exists; ignoring the different "
+                                f"{', '.join(ignored)} passed to get_client()")
+        return _client
+
+
+"""
+Install an already-built client as the process-wide one (e.g. to share it across scripts).
+"""
+def set_client(client):
+    global _client
+    with _client_lock:
+        _client = client
@@ -0,0 +1,136 @@
+"""
+Columnar output for large flattened exports.
+
+Rows are buffered and written in batches as Parquet row groups or Arrow IPC record
+batches, so a fleet-wide export never has to sit in memory as one list. pyarrow is
+optional: without it the sink falls back to CSV next to the requested path. It is only
+imported once a Parquet or Arrow file is actually requested.
+"""
+import csv
+import importlib.util
+import logging
+import os
+
+pa = pq = None
+
+PARQUET = 'parquet'
+ARROW = 'arrow'
+CSV = 'csv'
+
+FORMATS = (PARQUET, ARROW, CSV)
+
+
+def columnar_available():
+    return importlib.util.find_spec('pyarrow') is not None
+
+
+def _load_pyarrow():
+    # Import pyarrow on first use; returns whether it is installed
+    global pa, pq
+    if pa is None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            return False
+        pa, pq = pyarrow, pyarrow.parquet
+    return True
+
+
+class ColumnarSink:
+    """
+    Write rows ({column: value} dicts) to Parquet, Arrow IPC or CSV.
+
+    Every column is stored as a nullable string except `bool_columns`; "" becomes null.
+    `dictionary_columns` (low-cardinality values such as image, cluster and namespace)
+    are dictionary-encoded against one dictionary per column that grows across batches,
+    so each distinct value is stored once (Arrow IPC files only allow a single
+    dictionary per field, extended through deltas).
+
+    When pyarrow is not installed a Parquet/Arrow request is written as CSV instead and
+    `path`/`fmt` are updated to say so.
+    """
+
+    def __init__(self, path, columns, fmt=PARQUET, dictionary_columns=(), bool_columns=(), batch_rows=50000):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unsupported format: {fmt}")
+        if fmt != CSV and not _load_pyarrow():
+            csv_path = os.path.splitext(path)[0] + '.csv'
+            logging.warning(f"pyarrow is not installed; writing {csv_path} instead of {path}")
+            path, fmt = csv_path, CSV
+        self.path = path
+        self.fmt = fmt
+        self.columns = list(columns)
+        self.dictionary_columns = set(dictionary_columns)
+        self.bool_columns = set(bool_columns)
+        self.batch_rows = batch_rows
+        self.count = 0
+        self._rows = []
+        # dictionary column -> {value: index}, shared by every batch
+        self._dictionaries = {column: {} for column in self.dictionary_columns}
+        self._writer = None
+        self._file = None
+        if fmt != CSV:
+            self.schema = pa.schema([pa.field(c, self._type(c)) for c in self.columns])
+
+    def _type(self, column):
+        if column in self.bool_columns:
+            return pa.bool_()
+        if column in self.dictionary_columns:
+            return pa.dictionary(pa.int32(), pa.string())
+        return pa.string()
+
+    def __enter__(self):
+        if self.fmt == CSV:
+            self._file = open(self.path, 'w', newline='')
+            self._writer = csv.DictWriter(self._file, fieldnames=self.columns, extrasaction='ignore')
+            self._writer.writeheader()
+        elif self.fmt == PARQUET:
+            self._writer = pq.ParquetWriter(self.path, self.schema, compression='zstd')
+        else:
+            self._file = pa.OSFile(self.path, 'wb')
+            self._writer = pa.ipc.new_file(self._file, self.schema,
+                                           options=pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True))
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def write_many(self, rows):
+        if self.fmt == CSV:
+            self._writer.writerows(rows)
+            self.count += len(rows)
+            return
+        self._rows.extend(rows)
+        if len(self._rows) >= self.batch_rows:
+            self._flush()
+
+    def _column(self, column):
+        values = [row.get(column) for row in self._rows]
+        if column in self.bool_columns:
+            return pa.array([v if isinstance(v, bool) else None for v in values], type=pa.bool_())
+        values = [None if v is None or v == '' else v if isinstance(v, str) else str(v) for v in values]
+        if column not in self.dictionary_columns:
+            return pa.array(values, type=pa.string())
+        dictionary = self._dictionaries[column]
+        indices = [None if v is None else dictionary.setdefault(v, len(dictionary)) for v in values]
+        return pa.DictionaryArray.from_arrays(pa.array(indices, type=pa.int32()),
+                                              pa.array(list(dictionary), type=pa.string()))
+
+    def _flush(self):
+        if not self._rows:
+            return
+        batch = pa.record_batch([self._column(c) for c in self.columns], schema=self.schema)
+        self._writer.write_batch(batch)
+        self.count += len(self._rows)
+        self._rows = []
+
+    def close(self):
+        if self._writer is None:
+            return
+        if self.fmt != CSV:
+            self._flush()
+            self._writer.close()
+        if self._file is not None:
+            self._file.close()
+        self._writer = self._file = None
@@ -0,0 +1,56 @@
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    # Nearest-rank percentile.
+    index = min(len(ordered) - 1, max(0, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class Throughput:
+    """Collects per-call latencies and reports rate and p50/p95 over a run."""
+
+    def __init__(self):
+        self.latencies = []
+        self.started = time.monotonic()
+
+    def record(self, seconds):
+        self.latencies.append(seconds)
+
+    def summary(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        return {
+            'count': len(self.latencies),
+            'elapsed': elapsed,
+            'per_second': len(self.latencies) / elapsed,
+            'p50': percentile(self.latencies, 50),
+            'p95': percentile(self.latencies, 95),
+        }
+
+
+def map_ordered(fn, items, workers=8, limiter=None, stats=None):
+    """
+    Run fn over items on a bounded thread pool and return the results in input order.
+
+    `limiter` (a TokenBucket) is acquired before each call; `stats` (a Throughput)
+    receives the latency of each call. Exceptions from fn propagate to the caller.
+    """
+    def timed(item):
+        if limiter is not None:
+            limiter.acquire()
+        start = time.monotonic()
+        try:
+            return fn(item)
+        finally:
+            if stats is not None:
+                stats.record(time.monotonic() - start)
+
+    if workers <= 1:
+        return [timed(item) for item in items]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(timed, items))
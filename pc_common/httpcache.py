@@ -0,0 +1,183 @@
+"""
+Opt-in on-disk cache for read-only API responses.
+
+Scripts run back to back (a nightly pipeline, say) keep fetching the same multi-MB
+listings. Responses to the endpoints in `ttls` are kept in a SQLite file, keyed on
+method, URL, body and identity, and served from disk until their TTL runs out. A stale
+entry with an ETag or Last-Modified header is revalidated with If-None-Match /
+If-Modified-Since, so an unchanged listing costs a 304 instead of a full download.
+The file is capped at `max_bytes`; the least recently used entries go first.
+"""
+import fnmatch
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+# "METHOD path" glob -> seconds a response stays fresh
+DEFAULT_TTLS = {
+    'GET code/api/v2/repositories': 900,
+    'GET user/role': 900,
+    'GET user/role/*': 900,
+    'GET code/api/v1/tag-rules': 900,
+}
+# "METHOD path" glob of a write -> cached paths it makes stale besides its own. Repositories are
+# deleted through the bridgecrew API but listed through the code API
+DEFAULT_INVALIDATES = {
+    'DELETE bridgecrew/api/v2/repositories/*': ('code/api/v2/repositories',),
+    'PUT bridgecrew/api/v2/repositories/*': ('code/api/v2/repositories',),
+}
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    path TEXT,
+    status INTEGER,
+    headers TEXT,
+    body BLOB,
+    etag TEXT,
+    last_modified TEXT,
+    stored REAL,
+    used REAL,
+    size INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_responses_used ON responses (used);
+CREATE INDEX IF NOT EXISTS idx_responses_path ON responses (path);
+"""
+
+
+class ResponseCache:
+    """
+    SQLite-backed HTTP response cache, shared by every thread of a client.
+
+    `ttls` maps "METHOD path" globs (paths without the API host, e.g.
+    'GET user/role/*') to a TTL in seconds; only matching requests are cached, and
+    only 200 responses are stored. A successful write (POST, PUT, DELETE) drops the
+    cached entries for its path, the collection above it and anything below it, so
+    a script never reads back a listing older than its own changes. `invalidates`
+    maps "METHOD path" globs of writes to the other paths they make stale, for a
+    resource that is changed through one endpoint and listed through another.
+    """
+
+    def __init__(self, path, ttls=None, max_bytes=DEFAULT_MAX_BYTES, invalidates=None):
+        self.path = path
+        self.ttls = DEFAULT_TTLS if ttls is None else ttls
+        self.invalidates = DEFAULT_INVALIDATES if invalidates is None else invalidates
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def ttl(self, method, path):
+        """TTL for a request, or None when it isn't cacheable."""
+        route = f"{method.upper()} {path}"
+        for pattern, seconds in self.ttls.items():
+            if fnmatch.fnmatchcase(route, pattern):
+                return seconds
+        return None
+
+    @staticmethod
+    def key(method, url, body=None, identity=None):
+        digest = hashlib.sha256()
+        for part in (method.upper(), url, identity or '', body or ''):
+            digest.update(part.encode() if isinstance(part, str) else part)
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def lookup(self, key):
+        """The stored entry as a dict (with its age in seconds), or None."""
+        with self._lock:
+            row = self.conn.execute("SELECT status, headers, body, etag, last_modified, stored FROM responses "
+                                    "WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            with self.conn:
+                self.conn.execute("UPDATE responses SET used = ? WHERE key = ?", (time.time(), key))
+        status, headers, body, etag, last_modified, stored = row
+        return {'status': status, 'headers': json.loads(headers), 'body': body, 'etag': etag,
+                'last_modified': last_modified, 'age': time.time() - stored}
+
+    def validators(self, entry):
+        """Conditional request headers for revalidating a stale entry."""
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def store(self, key, path, response):
+        body = response.content
+        headers = dict(response.headers)
+        now = time.time()
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, path, status, headers, body, etag, last_modified, stored, "
+                "used, size) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, path, response.status_code, json.dumps(headers), body, response.headers.get('ETag'),
+                 response.headers.get('Last-Modified'), now, now, len(body)))
+            self._evict()
+
+    def refresh(self, key):
+        """The server answered 304: the entry is fresh again."""
+        now = time.time()
+        with self._lock, self.conn:
+            self.conn.execute("UPDATE responses SET stored = ?, used = ? WHERE key = ?", (now, now, key))
+
+    def invalidate(self, path, method=None):
+        """Drop the entries a successful `method` write to `path` makes stale; returns how many."""
+        stale = [path]
+        if method is not None:
+            route = f"{method.upper()} {path}"
+            for pattern, paths in self.invalidates.items():
+                if fnmatch.fnmatchcase(route, pattern):
+                    stale.extend(paths)
+        removed = 0
+        with self._lock, self.conn:
+            for stale_path in dict.fromkeys(stale):
+                parent = stale_path.rsplit('/', 1)[0]
+                removed += self.conn.execute(
+                    "DELETE FROM responses WHERE path = ? OR path = ? OR path LIKE ? ESCAPE '\\'",
+                    (stale_path, parent, _like_prefix(stale_path) + '/%')).rowcount
+        return removed
+
+    def clear(self):
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM responses")
+
+    def _evict(self):
+        # Drop least recently used entries until the cache fits in max_bytes
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self.conn.execute("SELECT key, size FROM responses ORDER BY used").fetchall():
+            self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    @staticmethod
+    def response(entry, url):
+        """Rebuild a requests.Response from a cached entry."""
+        response = Response()
+        response.status_code = entry['status']
+        response.reason = 'OK'
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = entry['body']
+        response.url = url
+        response.from_cache = True
+        return response
+
+
+def _like_prefix(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
@@ -0,0 +1,132 @@
+import json
+
+JSON_LINES = 'jsonl'
+JSON_ARRAY = 'json'
+
+
+class JsonSink:
+    """
+    Append records to a file as they arrive instead of dumping one big list at the end.
+
+    `fmt='jsonl'` writes one compact JSON object per line. `fmt='json'` writes the
+    indented JSON array that json.dump(..., indent=4) would produce; the closing bracket
+    is written on close, so the file stays valid even if the run fails part way.
+    Each write_many() call is flushed to disk.
+
+    Pass `resume_at` (a position previously returned by tell()) to reopen an existing
+    file, drop anything written after that point and keep appending from there.
+    """
+
+    def __init__(self, path, fmt=JSON_LINES, indent=4, resume_at=None):
+        if fmt not in (JSON_LINES, JSON_ARRAY):
+            raise ValueError(f"Unsupported format: {fmt}")
+        self.path = path
+        self.fmt = fmt
+        self.indent = indent
+        self.resume_at = resume_at
+        self.count = 0
+        self._empty = True
+        self._file = None
+
+    def __enter__(self):
+        if self.resume_at is None:
+            self._file = open(self.path, 'w')
+            if self.fmt == JSON_ARRAY:
+                self._file.write('[')
+        else:
+            self._file = open(self.path, 'r+')
+            self._file.seek(self.resume_at)
+            self._file.truncate()
+            self._empty = self.resume_at <= (1 if self.fmt == JSON_ARRAY else 0)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def write_many(self, records):
+        for record in records:
+            if self.fmt == JSON_LINES:
+                self._file.write(json.dumps(record, separators=(',', ':')) + '\n')
+            else:
+                pad = ' ' * self.indent
+                body = json.dumps(record, indent=self.indent).replace('\n', '\n' + pad)
+                self._file.write(('\n' if self._empty else ',\n') + pad + body)
+            self._empty = False
+            self.count += 1
+        self._file.flush()
+
+    def tell(self):
+        """Position after the last flushed record, usable as `resume_at` later."""
+        return self._file.tell()
+
+    def close(self):
+        if self._file is None:
+            return
+        if self.fmt == JSON_ARRAY:
+            self._file.write(']' if self._empty else '\n]')
+        self._file.close()
+        self._file = None
+
+
+def _iter_json_array(f, chunk_size):
+    decoder = json.JSONDecoder()
+    buf, eof = '', False
+
+    def more():
+        nonlocal buf, eof
+        chunk = f.read(chunk_size)
+        if chunk:
+            buf += chunk
+        else:
+            eof = True
+
+    while not buf.lstrip() and not eof:
+        more()
+    buf = buf.lstrip()
+    if not buf.startswith('['):
+        raise ValueError("Expected a JSON array")
+    buf = buf[1:]
+    while True:
+        buf = buf.lstrip(' \t\r\n,')
+        if buf.startswith(']'):
+            return
+        if not buf:
+            if eof:
+                raise ValueError("Unterminated JSON array")
+            more()
+            continue
+        try:
+            record, end = decoder.raw_decode(buf)
+        except json.JSONDecodeError:
+            record, end = None, None
+        # Only trust a decode that is followed by more input; a number at the edge of a
+        # chunk could otherwise be cut short.
+        if end is None or (end == len(buf) and not eof):
+            if eof:
+                raise ValueError("Truncated JSON array")
+            more()
+            continue
+        yield record
+        buf = buf[end:]
+
+
+def iter_records(path, chunk_size=1 << 16):
+    """
+    Lazily yield the records of a file written by JsonSink (or by json.dump of a list).
+    The format is detected from the first character: '[' is a JSON array, otherwise JSON Lines.
+    """
+    with open(path, 'r') as f:
+        head = ''
+        while True:
+            ch = f.read(1)
+            if not ch or not ch.isspace():
+                head = ch
+                break
+        f.seek(0)
+        if head == '[':
+            yield from _iter_json_array(f, chunk_size)
+            return
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
@@ -0,0 +1,94 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PageFetchError(Exception):
+    def __init__(self, index):
+        super().__init__(f"Failed to fetch page {index}")
+        self.index = index
+
+
+class Paginator:
+    """
+    Iterate a paged API with up to `window` pages in flight, yielding batches in page order.
+
+    `fetch_page(index, size)` returns the records of page `index` for a page size of `size`
+    (a list), or None on error. Iteration stops at the first empty page, or once
+    `total` records are covered when the API reports a total count.
+
+    When `max_page_size` is larger than `page_size` the first page is re-requested with
+    doubling sizes while the server keeps filling it, so the walk uses the largest page
+    size the server actually accepts. `limiter` (a TokenBucket) is acquired per request.
+    Pass `first_page` to reuse records already fetched for page 0 (e.g. by a count probe).
+    """
+
+    def __init__(self, fetch_page, page_size=50, max_page_size=None, window=4, total=None,
+                 start=0, limiter=None, first_page=None):
+        self.fetch_page = fetch_page
+        self.page_size = page_size
+        self.max_page_size = max_page_size or page_size
+        self.window = max(1, window)
+        self.total = total
+        self.start = start
+        self.limiter = limiter
+        self.first_page = first_page
+        self.pages_done = start
+
+    def _fetch(self, index, size=None):
+        if self.limiter is not None:
+            self.limiter.acquire()
+        batch = self.fetch_page(index, size or self.page_size)
+        if batch is None:
+            raise PageFetchError(index)
+        return batch
+
+    def _probe(self):
+        batch = self._fetch(0)
+        while len(batch) == self.page_size and self.page_size < self.max_page_size:
+            bigger = min(self.page_size * 2, self.max_page_size)
+            try:
+                candidate = self._fetch(0, bigger)
+            except Exception:
+                break
+            if len(candidate) <= len(batch):
+                # Silently capped at the current size; keep it.
+                break
+            # A short page is either the end of the data or the server's cap; both are safe sizes.
+            self.page_size, batch = min(bigger, len(candidate)), candidate
+        return batch
+
+    def _in_range(self, index):
+        return self.total is None or index * self.page_size < self.total
+
+    def __iter__(self):
+        index = self.start
+        if not self._in_range(index):
+            return
+        if index == 0 and self.first_page is not None:
+            first = self.first_page
+        else:
+            first = self._probe() if index == 0 else self._fetch(index)
+        if not first:
+            return
+        self.pages_done = index + 1
+        yield first
+
+        next_index = index + 1
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.window) as executor:
+            try:
+                while True:
+                    while len(pending) < self.window and self._in_range(next_index):
+                        pending.append((next_index, executor.submit(self._fetch, next_index)))
+                        next_index += 1
+                    if not pending:
+                        return
+                    page_index, future = pending.popleft()
+                    batch = future.result()
+                    if not batch:
+                        return
+                    self.pages_done = page_index + 1
+                    yield batch
+            finally:
+                for _, future in pending:
+                    future.cancel()
@@ -0,0 +1,95 @@
+"""
+Compiled field projections for flattening API records.
+
+The field list is compiled once into a generated Python function, instead of splitting
+dotted paths ('processes.static.md5') and looping over the fields for every record.
+Lookups follow the rules the profile scripts always used: a list on the way down
+resolves to its first element, a missing key resolves to "" and so does a value that
+is still a dict at the end of the path.
+"""
+
+_EMPTY = {}
+
+
+def _compile(pairs, name='project'):
+    # pairs: [(column, (key, key, ...)), ...] -> function(record) -> {column: value}
+    lines = [f"def {name}(r):", "    row = {}"]
+    for column, keys in pairs:
+        lines.append("    d = r")
+        for key in keys:
+            lines.append("    if type(d) is list: d = d[0] if d else _EMPTY")
+            lines.append("    if type(d) is not dict: d = _EMPTY")
+            lines.append(f"    d = d.get({key!r}, _EMPTY)")
+        lines.append(f"    row[{column!r}] = '' if type(d) is dict else d")
+    lines.append("    return row")
+    namespace = {'_EMPTY': _EMPTY}
+    exec("\n".join(lines), namespace)
+    return namespace[name]
+
+
+def _compile_list(keys):
+    # Walk like a projection, but return the list found at the end of the path.
+    def get(record):
+        data = record
+        for key in keys:
+            if isinstance(data, list):
+                data = data[0] if data else _EMPTY
+            if not isinstance(data, dict):
+                return []
+            data = data.get(key)
+        if isinstance(data, dict):
+            return [data]
+        return data if isinstance(data, list) else []
+    return get
+
+
+class Projection:
+    """
+    Flatten records into {column: value} dicts.
+
+    `fields` is a list of dotted paths, or (column, path) pairs when the column name
+    differs from the path. With `explode` set to a list path (e.g. 'processes.static'),
+    explode() yields one row per element of that list; fields under the exploded path
+    come from the element, all others from the record. A record whose list is empty
+    still yields one row, with blanks for the element fields.
+    """
+
+    def __init__(self, fields, explode=None):
+        pairs = [(f, f) if isinstance(f, str) else tuple(f) for f in fields]
+        self.columns = [column for column, _ in pairs]
+        self.explode_path = explode
+        prefix = f"{explode}." if explode else None
+        base = [(column, tuple(path.split('.'))) for column, path in pairs
+                if not (prefix and path.startswith(prefix))]
+        element = [(column, tuple(path[len(prefix):].split('.'))) for column, path in pairs
+                   if prefix and path.startswith(prefix)]
+        self._base = _compile(base)
+        self._element = _compile(element) if element else None
+        self._elements = _compile_list(tuple(explode.split('.'))) if explode else None
+
+    def project(self, record):
+        row = self._base(record)
+        if self._element is not None:
+            # Not exploding: element fields come from the first element.
+            elements = self._elements(record)
+            row.update(self._element(elements[0] if elements else _EMPTY))
+        return row
+
+    def project_many(self, records):
+        project = self.project
+        return [project(record) for record in records]
+
+    def explode(self, record):
+        base = self._base(record)
+        if self._element is None:
+            yield base
+            return
+        elements = [e for e in self._elements(record) if isinstance(e, dict)] or [_EMPTY]
+        for element in elements:
+            row = dict(base)
+            row.update(self._element(element))
+            yield row
+
+    def explode_many(self, records):
+        explode = self.explode
+        return [row for record in records for row in explode(record)]
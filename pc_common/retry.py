@@ -0,0 +1,72 @@
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+# Statuses where the request was not processed (or the gateway gave up), so retrying is safe.
+RETRY_STATUSES = (429, 502, 503, 504)
+
+# Path segments that are identifiers rather than part of the route (numbers, UUIDs, long hex ids)
+_ID_SEGMENT = re.compile(r'^(\d+|[0-9a-fA-F-]{16,})$')
+
+
+def endpoint_key(method, url):
+    """'GET user/role/{id}' style key, so counters group by route rather than by resource."""
+    path = urlsplit(url).path.strip('/')
+    return f"{method.upper()} " + '/'.join('{id}' if _ID_SEGMENT.match(p) else p for p in path.split('/'))
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter: attempt n waits a random time in
+    [0, min(max_backoff, backoff * 2**n)]. A Retry-After header (seconds or HTTP date)
+    takes precedence.
+    """
+
+    def __init__(self, retries=3, backoff=0.5, max_backoff=30.0, statuses=RETRY_STATUSES):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.statuses = set(statuses)
+
+    def should_retry(self, attempt, response=None):
+        if attempt >= self.retries:
+            return False
+        return response is None or response.status_code in self.statuses
+
+    def delay(self, attempt, response=None):
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after:
+            try:
+                return min(self.max_backoff, max(0.0, float(retry_after)))
+            except ValueError:
+                try:
+                    return min(self.max_backoff, max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time()))
+                except (TypeError, ValueError):
+                    pass
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+
+
+class EndpointStats:
+    """Thread-safe per-endpoint counters of requests, retries, timeouts, errors and cache hits."""
+
+    FIELDS = ('requests', 'retries', 'timeouts', 'errors', 'cached')
+
+    def __init__(self):
+        self._counts = defaultdict(lambda: dict.fromkeys(self.FIELDS, 0))
+        self._lock = threading.Lock()
+
+    def incr(self, key, field):
+        with self._lock:
+            self._counts[key][field] += 1
+
+    def summary(self):
+        with self._lock:
+            return {key: dict(counts) for key, counts in sorted(self._counts.items())}
+
+    def lines(self):
+        return [f"{key}: " + ', '.join(f"{field} {counts[field]}" for field in self.FIELDS)
+                for key, counts in self.summary().items()]
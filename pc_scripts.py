@@ -0,0 +1,114 @@
+"""
+pc-scripts: one entry point for the CAS scripts in this repository.
+
+    python3 pc_scripts.py repos assign-role --dry-run
+    python3 -m pc_scripts sbom analyze --sync skip
+    python3 pc_scripts.py                  # list the commands
+
+A command's script is only imported when that command runs, and the profiles
+scripts only load pcpi, dateutil and pytz once they talk to the API, so every
+command's --help works without them. Every script keeps working on its own
+and exposes main(argv); run_command() runs several of them in one process, where
+they share the pc_common client and its login.
+"""
+import importlib.util
+import os
+import sys
+import threading
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+_load_lock = threading.Lock()
+
+# group -> command -> (script, description)
+COMMANDS = {
+    'repos': {
+        'onboard': ('Integrations/IntMultiRepos.py', "Onboard the repositories listed in input.txt"),
+        'assign-role': ('role_assignment.py', "Assign all onboarded repositories to one or more roles"),
+        'tag-rule': ('yor_tag_rule/yor_tag_rule.py', "Update Yor tag rule repositories"),
+        'metadata': ('metadata.py', "Download the archived repositories metadata to metadata.json"),
+        'remove-archived': ('arch_remove.py', "Delete archived repositories from Prisma Cloud"),
+    },
+    'assets': {
+        'ci-plugins': ('assets.py', "Export CAS CI plugin assets to CSV"),
+    },
+    'sbom': {
+        'analyze': ('sbom/run_dependency_analysis.py', "Dependency analysis and source location workflow"),
+    },
+    'profiles': {
+        'export': ('profiles/get-profiles-container.py', "Export container runtime profiles"),
+        'md5-match': ('profiles/get-matching-md5-profiles.py',
+                      "Match container profile process MD5s against suspicious binary incidents"),
+    },
+    'pipeline': {
+        'run': ('pipeline.py', "Run a job spec of commands as stages over one shared session"),
+    },
+}
+
+"""
+Import the script behind a command, once per process, and return the module
+"""
+def load_command(group, name):
+    script, _ = COMMANDS[group][name]
+    module_name = f"pc_scripts_{group}_{name}".replace('-', '_')
+    # Pipeline stages load their commands from several threads
+    with _load_lock:
+        module = sys.modules.get(module_name)
+        if module is None:
+            spec = importlib.util.spec_from_file_location(module_name, os.path.join(ROOT, script))
+            module = importlib.util.module_from_spec(spec)
+            sys.modules[module_name] = module
+            try:
+                spec.loader.exec_module(module)
+            except BaseException:
+                del sys.modules[module_name]
+                raise
+    return module
+
+"""
+Run a command's main(argv) and return its exit status. A script that calls sys.exit()
+only ends its own command
+"""
+def run_command(group, name, argv=()):
+    try:
+        status = load_command(group, name).main(list(argv))
+    except SystemExit as e:
+        status = e.code
+    if isinstance(status, str):
+        print(status, file=sys.stderr)
+        return 1
+    return status or 0
+
+def usage(groups=COMMANDS):
+    lines = ["usage: pc-scripts GROUP COMMAND [options]", "",
+             "Run 'pc-scripts GROUP COMMAND --help' for the options of a command.", ""]
+    for group in groups:
+        lines.append(group)
+        for name, (_, description) in COMMANDS[group].items():
+            lines.append(f"  {name:<18}{description}")
+    return "\n".join(lines)
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if not argv or argv[0] in ('-h', '--help'):
+        print(usage())
+        return 0
+    group = argv[0]
+    if group not in COMMANDS:
+        print(usage(), file=sys.stderr)
+        print(f"\npc-scripts: unknown group '{group}'", file=sys.stderr)
+        return 2
+    if len(argv) < 2 or argv[1] in ('-h', '--help'):
+        print(usage([group]))
+        return 0
+    name = argv[1]
+    if name not in COMMANDS[group]:
+        print(usage([group]), file=sys.stderr)
+        print(f"\npc-scripts: unknown command '{group} {name}'", file=sys.stderr)
+        return 2
+    # So the command's --help and errors read "pc-scripts GROUP COMMAND"
+    sys.argv[0] = f"pc-scripts {group} {name}"
+    return run_command(group, name, argv[2:])
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,233 @@
+"""
+Run several pc-scripts commands as the stages of one job, in one process.
+
+The job spec (YAML or JSON) lists the stages; a stage waits for the stages named in
+its `after` list, and stages that don't depend on each other run concurrently:
+
+    workers: 2
+    stages:
+      - name: onboard
+        command: repos onboard
+        args: [--input, input.txt]
+      - name: roles
+        command: repos assign-role
+        after: [onboard]
+      - name: tag-rules
+        command: repos tag-rule
+        args: [--mapping, tag_rules.json]
+        after: [onboard]
+      - name: metadata
+        command: repos metadata
+
+Every stage uses the same pc_common client, so the job logs in once. Read-only
+listings (the repository inventory, roles, tag rules) go through a response cache
+kept for the length of the run, or PRISMA_HTTP_CACHE when that is set. The first
+stage that needs the inventory fetches it, the others reuse it, and a stage that
+changes repositories (onboarding) drops it so later stages see the new list.
+"""
+import argparse
+import json
+import shlex
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+from pc_common import ResponseCache, get_client
+from pc_common.httpcache import DEFAULT_TTLS
+from pc_scripts import COMMANDS, run_command
+
+# Stages run at once, unless the spec says otherwise
+STAGE_WORKERS = 4
+# How long the in-memory response cache keeps a listing; long enough to span the whole job
+PIPELINE_CACHE_TTL = 6 * 3600
+
+OK = 'ok'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+
+class Colors:
+    RED = '\033[91m'
+    GREEN = '\033[92m'
+    YELLOW = '\033[93m'
+    END = '\033[0m'
+    CYAN = '\033[96m'
+
+def color_print(text, color):
+    print(color + text + Colors.END)
+
+"""
+Read and check a job spec. Returns (stages, workers); each stage is a dict with name,
+group, command, args and after
+"""
+def load_spec(path):
+    with open(path, 'r') as f:
+        if path.endswith(('.yaml', '.yml')):
+            if yaml is None:
+                raise ValueError("PyYAML is not installed; install it or write the job spec as JSON")
+            spec = yaml.safe_load(f)
+        else:
+            spec = json.load(f)
+    if isinstance(spec, list):
+        spec = {"stages": spec}
+    if not isinstance(spec, dict) or not spec.get("stages"):
+        raise ValueError(f"{path}: no stages")
+
+    stages = []
+    for number, raw in enumerate(spec["stages"], start=1):
+        command = raw.get("command")
+        command = command.split() if isinstance(command, str) else list(command or [])
+        if len(command) != 2 or command[0] not in COMMANDS or command[1] not in COMMANDS[command[0]]:
+            raise ValueError(f"stage {number}: unknown command {raw.get('command')!r}")
+        args = raw.get("args") or []
+        after = raw.get("after") or []
+        stages.append({
+            "name": str(raw.get("name") or " ".join(command)),
+            "group": command[0],
+            "command": command[1],
+            "args": shlex.split(args) if isinstance(args, str) else [str(arg) for arg in args],
+            "after": [after] if isinstance(after, str) else list(after),
+        })
+
+    names = [stage["name"] for stage in stages]
+    duplicates = {name for name in names if names.count(name) > 1}
+    if duplicates:
+        raise ValueError(f"duplicate stage names: {', '.join(sorted(duplicates))}")
+    for stage in stages:
+        unknown = [name for name in stage["after"] if name not in names]
+        if unknown:
+            raise ValueError(f"stage '{stage['name']}' runs after unknown stages: {', '.join(unknown)}")
+    stage_order(stages)
+    workers = int(spec.get("workers", STAGE_WORKERS))
+    if workers < 1:
+        raise ValueError(f"workers must be at least 1, not {workers}")
+    return stages, workers
+
+"""
+Stage names in an order that respects `after`; raises ValueError on a cycle
+"""
+def stage_order(stages):
+    order, done = [], set()
+    remaining = list(stages)
+    while remaining:
+        ready = [stage for stage in remaining if set(stage["after"]) <= done]
+        if not ready:
+            raise ValueError(f"stages depend on each other in a cycle: "
+                             f"{', '.join(stage['name'] for stage in remaining)}")
+        for stage in ready:
+            order.append(stage["name"])
+            done.add(stage["name"])
+            remaining.remove(stage)
+    return order
+
+def run_stage(stage):
+    started = time.monotonic()
+    color_print(f"▶️  {stage['name']}: {stage['group']} {stage['command']} {' '.join(stage['args'])}".rstrip(),
+                Colors.CYAN)
+    try:
+        status = run_command(stage["group"], stage["command"], stage["args"])
+    except Exception as e:
+        color_print(f"❌ {stage['name']}: {e}", Colors.RED)
+        status = 1
+    return status, time.monotonic() - started
+
+"""
+Run the stages, each as soon as the stages it comes after have succeeded, up to
+`workers` at a time. A stage whose dependency failed is skipped; independent stages
+still run. Returns {stage name: {"status", "exit", "seconds"}}
+"""
+def run_pipeline(stages, workers=STAGE_WORKERS):
+    results = {}
+    pending = list(stages)
+    running = {}
+    workers = max(1, workers)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while pending or running:
+            for stage in list(pending):
+                states = [results[name]["status"] if name in results else None for name in stage["after"]]
+                if FAILED in states or SKIPPED in states:
+                    results[stage["name"]] = {"status": SKIPPED, "exit": None, "seconds": 0.0}
+                    color_print(f"⏭️  {stage['name']}: skipped, a stage it runs after did not succeed", Colors.YELLOW)
+                    pending.remove(stage)
+                elif all(state == OK for state in states) and len(running) < workers:
+                    running[executor.submit(run_stage, stage)] = stage
+                    pending.remove(stage)
+            if not running:
+                continue  # only skips happened; look at the pending stages again
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                status, seconds = future.result()
+                results[stage["name"]] = {"status": OK if status == 0 else FAILED, "exit": status,
+                                          "seconds": round(seconds, 2)}
+                if status == 0:
+                    color_print(f"✅ {stage['name']}: done in {seconds:.1f}s", Colors.GREEN)
+                else:
+                    color_print(f"❌ {stage['name']}: failed with exit status {status} after {seconds:.1f}s", Colors.RED)
+    return results
+
+"""
+Give the shared client a response cache for the run, unless it already has one
+(PRISMA_HTTP_CACHE). Stages that don't use the Prisma API don't need the environment
+"""
+def share_client(use_cache=True):
+    try:
+        client = get_client()
+    except ValueError:
+        return None  # the stages that need the API report the missing variables themselves
+    if not use_cache:
+        client.cache = None
+    elif client.cache is None:
+        client.cache = ResponseCache(':memory:', ttls=dict.fromkeys(DEFAULT_TTLS, PIPELINE_CACHE_TTL))
+    return client
+
+def print_summary(stages, results, client):
+    color_print("📋 Pipeline summary:", Colors.CYAN)
+    for stage in stages:
+        result = results.get(stage["name"], {"status": SKIPPED, "seconds": 0.0})
+        print(f"   {stage['name']:<24}{result['status']:<9}{result['seconds']:>8.1f}s")
+    if client is not None:
+        color_print("📊 API calls per endpoint:", Colors.CYAN)
+        for line in client.stats.lines():
+            print(f"   {line}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a job spec of pc-scripts commands over one shared session")
+    parser.add_argument('spec', help="job spec, YAML (.yaml/.yml) or JSON")
+    parser.add_argument('--workers', type=int, help=f"stages run at once (default: the spec's, or {STAGE_WORKERS})")
+    parser.add_argument('--dry-run', action='store_true', help="check the spec and print the stage order only")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="don't share API listings between stages; every stage queries the API itself")
+    args = parser.parse_args(argv)
+
+    try:
+        stages, workers = load_spec(args.spec)
+    except (OSError, ValueError, TypeError, AttributeError) as e:
+        color_print(f"❌ Invalid job spec: {e}", Colors.RED)
+        return 2
+    if args.workers is not None:
+        if args.workers < 1:
+            color_print(f"❌ --workers must be at least 1, not {args.workers}", Colors.RED)
+            return 2
+        workers = args.workers
+
+    by_name = {stage["name"]: stage for stage in stages}
+    color_print(f"🧭 {len(stages)} stages, up to {workers} at a time:", Colors.CYAN)
+    for name in stage_order(stages):
+        after = by_name[name]["after"]
+        print(f"   {name}" + (f" (after {', '.join(after)})" if after else ""))
+    if args.dry_run:
+        return 0
+
+    client = share_client(not args.no_cache)
+    results = run_pipeline(stages, workers)
+    print_summary(stages, results, client)
+    return 0 if all(result["status"] == OK for result in results.values()) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
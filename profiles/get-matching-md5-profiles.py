@@ -1,12 +1,15 @@
+import argparse
 import csv
 import json
 import os
 import sys
-from pcpi import session_loader
-from time import sleep
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from dateutil.relativedelta import relativedelta
-import pytz
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [SCRIPT_DIR, os.path.join(SCRIPT_DIR, '..')]
+from pc_common import Paginator, Projection, TokenBucket
+from snapshot_store import SnapshotStore, content_hash
 
 # Setup Logging
 # Output formats and files
@@ -16,6 +19,29 @@ INCIDENT_OUTPUT_FORMAT = 'csv'
 INCIDENT_OUTPUT_FILE = f"incidents_output.{INCIDENT_OUTPUT_FORMAT}"
 MATCHED_OUTPUT_FILE = "matched_md5_profiles_with_incident_fields.csv"
 
+# Local snapshot of profiles and incidents; later runs only fetch incidents past the stored high-water
+# mark and only rewrite profiles whose content changed
+SNAPSHOT_DB = "profiles_snapshot.db"
+
+# Incidents are re-requested from this far before the high-water mark, in case late ones were indexed
+# after the previous run; anything already stored is skipped
+INCIDENT_OVERLAP = timedelta(minutes=10)
+
+# Join on every processes.static MD5 of a profile instead of only the first one
+JOIN_ALL_PROCESS_MD5S = False
+
+# Pagination: pages kept in flight per stream, and a requests/second ceiling (shared by all streams)
+# to be polite to the API
+PAGE_WINDOW = 4
+API_RATE = 4
+
+# The incident window is split into this many date sub-ranges, fetched in parallel with the profiles
+INCIDENT_WINDOWS = 3
+
+PROFILES_ENDPOINT = '/api/v1/profiles/container?limit={limit}&offset={offset}&project=Central+Console&reverse=false'
+INCIDENTS_ENDPOINT = ('/api/v1/audits/incidents?acknowledged=false&category=suspiciousBinary&from={from_date}'
+                      '&limit={limit}&offset={offset}&to={to_date}&type=host')
+
 # Target fields for container profiles
 PROFILE_FIELDS = [
     'state', 'learnedStartup', '_id', 'hash', 'image', 'os', 'archived',
@@ -35,194 +61,264 @@ MATCHED_FIELDS = PROFILE_FIELDS + [
     'incident.containerID', 'incident.imageName', 'incident.imageID', 'incident.profileID'
 ]
 
-# Utility to safely extract nested fields
-def get_nested(data, path):
-    keys = path.split('.')
-    for key in keys:
-        if isinstance(data, list):
-            data = data[0] if data else {}
-        data = data.get(key, {})
-    return data if not isinstance(data, dict) else ""
-
-def extract_profile_fields(profile):
-    flat = {}
-    for field in PROFILE_FIELDS:
-        flat[field] = get_nested(profile, field)
+# Top-level incident fields; the rest are read from the incident's (first) audit
+INCIDENT_TOP_LEVEL_FIELDS = ['_id', 'hostname', 'fqdn', 'containerName', 'containerID', 'imageName', 'imageID', 'profileID']
+
+# Field paths are compiled once; exploding processes.static gives one row per static process
+PROFILE_PROJECTION = Projection(PROFILE_FIELDS, explode='processes.static')
+INCIDENT_PROJECTION = Projection([field if field in INCIDENT_TOP_LEVEL_FIELDS else (field, f"audits.{field}")
+                                  for field in INCIDENT_FIELDS])
+
+def join_account_ids(rows):
     # accountIDs may be a list; join if needed
-    if isinstance(flat.get("accountIDs"), list):
-        flat["accountIDs"] = ",".join(flat["accountIDs"])
-    return flat
-
-def extract_incident_fields(incident):
-    flat = {}
-    audit = get_nested(incident, 'audits')
-    for field in INCIDENT_FIELDS:
-        if field in ['_id', 'hostname', 'fqdn', 'containerName', 'containerID', 'imageName', 'imageID', 'profileID']:
-            flat[field] = incident.get(field, '')
-        else:
-            flat[field] = get_nested(audit, field)
-    return flat
+    for row in rows:
+        if isinstance(row.get("accountIDs"), list):
+            row["accountIDs"] = ",".join(row["accountIDs"])
+    return rows
+
+# Incident fields copied onto each matched profile row, as (output column, incident field)
+INCIDENT_JOIN_FIELDS = [(field, field[len('incident.'):]) for field in MATCHED_FIELDS if field.startswith('incident.')]
+
+def matched_rows(pairs):
+    # One matched row per (profile row, incident) pair sharing an MD5
+    for profile, incident in pairs:
+        matched = dict(profile)
+        for column, field in INCIDENT_JOIN_FIELDS:
+            matched[column] = incident[field]
+        yield matched
 
-# Load Session
-try:
+def load_session():
+    # pcpi is only needed to talk to the API, so --help works without it
+    from pcpi import session_loader
     print("Loading session...")
     session_managers = session_loader.load_config()
     session_man = session_managers[0]
-    cwp_session = session_man.create_cwp_session()
-except Exception as e:
-    print(f"Failed to load or authenticate session: {e}")
-    exit(1)
-
-# Calculate date range for incidents (last 3 months)
-end_date = datetime.now(pytz.UTC)
-start_date = end_date - relativedelta(months=3)
-from_date = start_date.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
-to_date = end_date.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
-
-# Fetch container profiles
-all_profiles = []
-limit = 100
-offset = 0
-
-try:
-    print("Fetching initial batch of container profiles...")
-    res = cwp_session.request(
-        'GET',
-        f'/api/v1/profiles/container?limit={limit}&offset={offset}&project=Central+Console&reverse=false'
-    )
-    total_count = int(res.headers.get("Total-Count", 0))
-    print(f"Total profiles to fetch: {total_count}")
+    return session_man.create_cwp_session()
 
-    while offset < total_count:
-        print(f"Fetching profile records {offset + 1} to {offset + limit}...")
-        try:
-            res = cwp_session.request(
-                'GET',
-                f'/api/v1/profiles/container?limit={limit}&offset={offset}&project=Central+Console&reverse=false'
-            )
-            res.raise_for_status()
-            batch = res.json()
-            for profile in batch:
-                all_profiles.append(extract_profile_fields(profile))
-        except Exception as err:
-            print(f"Error fetching profile batch at offset {offset}: {err}")
-            break
-        offset += limit
-        sleep(0.5)
-
-    print(f"Total profile records fetched: {len(all_profiles)}")
-
-except Exception as err:
-    print(f"Failed during profile data retrieval: {err}")
-    exit(1)
-
-# Write container profiles output
-try:
-    if PROFILE_OUTPUT_FORMAT == "json":
-        with open(PROFILE_OUTPUT_FILE, "w") as f:
-            json.dump(all_profiles, f, indent=4)
-    else:
-        with open(PROFILE_OUTPUT_FILE, "w", newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=PROFILE_FIELDS)
-            writer.writeheader()
-            writer.writerows(all_profiles)
-
-    print(f"Profile data written to {PROFILE_OUTPUT_FILE}")
-
-except Exception as err:
-    print(f"Failed to write profile output file: {err}")
-    exit(1)
-
-# Fetch incidents
-all_incidents = []
-offset = 0
-limit = 50
-
-try:
-    print("Fetching initial batch of incidents...")
-    res = cwp_session.request(
-        'GET',
-        f'/api/v1/audits/incidents?acknowledged=false&category=suspiciousBinary&from={from_date}&limit={limit}&offset={offset}&to={to_date}&type=host'
-    )
+def format_date(value):
+    return value.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+def date_windows(start, end, parts):
+    # Split [start, end] into `parts` consecutive sub-ranges
+    step = (end - start) / parts
+    return [(start + step * i, end if i == parts - 1 else start + step * (i + 1)) for i in range(parts)]
+
+def fetch_paged(cwp_session, label, endpoint, limit, limiter, on_batch, **params):
+    # Probe for Total-Count, reuse the probe response as page 0, then fetch the remaining pages in parallel
+    print(f"Fetching initial batch of {label} records...")
+    res = cwp_session.request('GET', endpoint.format(limit=limit, offset=0, **params))
+    res.raise_for_status()
     total_count = int(res.headers.get("Total-Count", 0))
-    print(f"Total incidents to fetch: {total_count}")
+    print(f"Total {label} records to fetch: {total_count}")
+
+    def fetch_page(index, size):
+        page_offset = index * size
+        print(f"Fetching {label} records {page_offset + 1} to {page_offset + size}...")
+        res = cwp_session.request('GET', endpoint.format(limit=size, offset=page_offset, **params))
+        res.raise_for_status()
+        return res.json() or []
+
+    pages = Paginator(fetch_page, page_size=limit, window=PAGE_WINDOW, total=total_count, limiter=limiter,
+                      first_page=res.json() or [])
+    # Returns whether the walk completed, so a partial fetch never prunes the store or moves the high-water mark
+    try:
+        for batch in pages:
+            on_batch(batch)
+    except Exception as err:
+        print(f"Error fetching {label} batch at offset {pages.pages_done * limit}: {err}")
+        return False
+    return True
+
+def fetch_profiles(cwp_session, limiter):
+    # (profile _id, content hash, first-process row, one row per static process)
+    profiles = []
+
+    def on_batch(batch):
+        rows = join_account_ids(PROFILE_PROJECTION.project_many(batch))
+        for profile, row in zip(batch, rows):
+            processes = join_account_ids(list(PROFILE_PROJECTION.explode(profile)))
+            profiles.append((profile.get('_id'), content_hash(profile), row, processes))
+
+    complete = fetch_paged(cwp_session, "profile", PROFILES_ENDPOINT, 100, limiter, on_batch)
+    return profiles, complete
+
+def fetch_incidents(cwp_session, window_start, window_end, limiter):
+    # (incident _id, time, row)
+    incidents = []
+
+    def on_batch(batch):
+        rows = INCIDENT_PROJECTION.project_many(batch)
+        incidents.extend((incident.get('_id'), incident.get('time', ''), row) for incident, row in zip(batch, rows))
+
+    label = f"incident ({window_start:%Y-%m-%d} - {window_end:%Y-%m-%d})"
+    complete = fetch_paged(cwp_session, label, INCIDENTS_ENDPOINT, 50, limiter, on_batch,
+                           from_date=format_date(window_start), to_date=format_date(window_end))
+    return incidents, complete
 
-    while offset < total_count:
-        print(f"Fetching incident records {offset + 1} to {offset + limit}...")
+"""
+Refresh the snapshot store from the API: every profile, and the incidents of the last
+3 months past the stored high-water mark. Returns False when a fetch failed
+"""
+def sync_snapshot(cwp_session, store, full=False):
+    # Like pcpi, dateutil and pytz are only loaded once the command talks to the API
+    from dateutil.parser import isoparse
+    from dateutil.relativedelta import relativedelta
+    import pytz
+
+    # Calculate date range for incidents (last 3 months)
+    end_date = datetime.now(pytz.UTC)
+    start_date = end_date - relativedelta(months=3)
+
+    if full:
+        store.reset_incidents()
+
+    # Only incidents newer than the last run are fetched; the store already holds the rest of the window
+    fetch_from = start_date
+    high_water = store.incident_high_water()
+    if high_water:
+        fetch_from = max(start_date, isoparse(high_water) - INCIDENT_OVERLAP)
+        print(f"Fetching incidents since {format_date(fetch_from)} (high-water mark {high_water})")
+
+    # Profiles and incidents are independent, so both streams (and every incident sub-range) run at once
+    limiter = TokenBucket(API_RATE)
+    with ThreadPoolExecutor(max_workers=1 + INCIDENT_WINDOWS) as executor:
+        profiles_future = executor.submit(fetch_profiles, cwp_session, limiter)
+        incident_futures = [executor.submit(fetch_incidents, cwp_session, window_start, window_end, limiter)
+                            for window_start, window_end in date_windows(fetch_from, end_date, INCIDENT_WINDOWS)]
+
+    try:
+        fetched_profiles, profiles_complete = profiles_future.result()
+        print(f"Total profile records fetched: {len(fetched_profiles)}")
+        generation = store.begin_profile_sync()
+        new, changed = store.upsert_profiles(fetched_profiles, generation)
+        removed = store.finish_profile_sync(generation) if profiles_complete else 0
+        print(f"Profiles: {new} new, {changed} changed, {len(fetched_profiles) - new - changed} unchanged, {removed} removed")
+    except Exception as err:
+        print(f"Failed during profile data retrieval: {err}")
+        return False
+
+    try:
+        fetched_incidents, incidents_complete = [], True
+        for future in incident_futures:
+            incidents, complete = future.result()
+            fetched_incidents.extend(incidents)
+            incidents_complete = incidents_complete and complete
+        print(f"Total incident records fetched: {len(fetched_incidents)}")
+        # Sub-ranges share their boundary timestamp and overlap the previous run; the store skips known _ids
+        added = store.add_incidents(fetched_incidents)
+        newest = max((t for _, t, _ in fetched_incidents if t), default=None)
+        expired = store.finish_incident_sync(newest if incidents_complete else None, format_date(start_date))
+        print(f"Incidents: {added} new, {expired} expired out of the window")
+    except Exception as err:
+        print(f"Failed during incident data retrieval: {err}")
+        return False
+
+    counts = store.counts()
+    print(f"Snapshot {store.path}: {counts['profiles']} profiles, {counts['processes']} static processes, "
+          f"{counts['incidents']} incidents")
+    return True
+
+"""
+Write the stored profiles and incidents to their output files. Returns False on failure
+"""
+def write_outputs(store):
+    # Write container profiles output
+    try:
+        all_profiles = list(store.profile_rows())
+        if PROFILE_OUTPUT_FORMAT == "json":
+            with open(PROFILE_OUTPUT_FILE, "w") as f:
+                json.dump(all_profiles, f, indent=4)
+        else:
+            with open(PROFILE_OUTPUT_FILE, "w", newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=PROFILE_FIELDS)
+                writer.writeheader()
+                writer.writerows(all_profiles)
+
+        print(f"Profile data written to {PROFILE_OUTPUT_FILE}")
+
+    except Exception as err:
+        print(f"Failed to write profile output file: {err}")
+        return False
+
+    # Write incidents output
+    try:
+        all_incidents = list(store.incident_rows())
+        if INCIDENT_OUTPUT_FORMAT == "json":
+            with open(INCIDENT_OUTPUT_FILE, "w") as f:
+                json.dump(all_incidents, f, indent=4)
+        else:
+            with open(INCIDENT_OUTPUT_FILE, "w", newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=INCIDENT_FIELDS)
+                writer.writeheader()
+                writer.writerows(all_incidents)
+
+        print(f"Incident data written to {INCIDENT_OUTPUT_FILE}")
+
+    except Exception as err:
+        print(f"Failed to write incident output file: {err}")
+        return False
+    return True
+
+"""
+Compare MD5 values and output matching profiles with additional incident fields; the join runs in the
+store on its MD5 indexes, over every static process with `all_process_md5s` or each profile's first one.
+Returns the number of matched rows, or None on failure
+"""
+def write_matches(store, all_process_md5s=JOIN_ALL_PROCESS_MD5S):
+    try:
+        # Joined rows are streamed straight into the CSV; the file is only created on the first match
+        matches_found = 0
+        matched_md5s = set()
+        f = writer = None
         try:
-            res = cwp_session.request(
-                'GET',
-                f'/api/v1/audits/incidents?acknowledged=false&category=suspiciousBinary&from={from_date}&limit={limit}&offset={offset}&to={to_date}&type=host'
-            )
-            res.raise_for_status()
-            batch = res.json()
-            for incident in batch:
-                all_incidents.append(extract_incident_fields(incident))
-        except Exception as err:
-            print(f"Error fetching incident batch at offset {offset}: {err}")
-            break
-        offset += limit
-        sleep(0.5)
-
-    print(f"Total incident records fetched: {len(all_incidents)}")
-
-except Exception as err:
-    print(f"Failed during incident data retrieval: {err}")
-    exit(1)
-
-# Write incidents output
-try:
-    if INCIDENT_OUTPUT_FORMAT == "json":
-        with open(INCIDENT_OUTPUT_FILE, "w") as f:
-            json.dump(all_incidents, f, indent=4)
-    else:
-        with open(INCIDENT_OUTPUT_FILE, "w", newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=INCIDENT_FIELDS)
-            writer.writeheader()
-            writer.writerows(all_incidents)
-
-    print(f"Incident data written to {INCIDENT_OUTPUT_FILE}")
-
-except Exception as err:
-    print(f"Failed to write incident output file: {err}")
-    exit(1)
-
-# Compare MD5 values and output matching profiles with additional incident fields
-try:
-    incident_md5s = set(incident['md5'] for incident in all_incidents if incident['md5'])
-    print(f"Total unique MD5s found in incidents: {len(incident_md5s)}")
-
-    matched_profiles = []
-    matches_found = 0
-
-    for profile in all_profiles:
-        profile_md5 = profile.get('processes.static.md5')
-        if profile_md5 in incident_md5s:
-            matching_incidents = [inc for inc in all_incidents if inc['md5'] == profile_md5]
-            for incident in matching_incidents:
-                matched = profile.copy()
-                # Add incident fields with prefix
-                matched['incident._id'] = incident['_id']
-                matched['incident.hostname'] = incident['hostname']
-                matched['incident.fqdn'] = incident['fqdn']
-                matched['incident.containerName'] = incident['containerName']
-                matched['incident.containerID'] = incident['containerID']
-                matched['incident.imageName'] = incident['imageName']
-                matched['incident.imageID'] = incident['imageID']
-                matched['incident.profileID'] = incident['profileID']
-                matched_profiles.append(matched)
+            for matched in matched_rows(store.matches(all_process_md5s)):
+                if writer is None:
+                    f = open(MATCHED_OUTPUT_FILE, "w", newline='')
+                    writer = csv.DictWriter(f, fieldnames=MATCHED_FIELDS)
+                    writer.writeheader()
+                writer.writerow(matched)
                 matches_found += 1
-            print(f"Matched profile MD5: {profile_md5} with {len(matching_incidents)} incidents.")
-
-    if matched_profiles:
-        with open(MATCHED_OUTPUT_FILE, "w", newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=MATCHED_FIELDS)
-            writer.writeheader()
-            writer.writerows(matched_profiles)
-        print(f"Found {matches_found} matched profiles. Data written to {MATCHED_OUTPUT_FILE}")
-    else:
-        print("No profiles found with matching MD5s. No matched file written.")
-
-except Exception as err:
-    print(f"Failed to compare MD5s or write matched profile data: {err}")
-    exit(1)
+                matched_md5s.add(matched['processes.static.md5'])
+        finally:
+            if f is not None:
+                f.close()
+
+        if matches_found:
+            print(f"Found {matches_found} matched profiles across {len(matched_md5s)} MD5s. "
+                  f"Data written to {MATCHED_OUTPUT_FILE}")
+        else:
+            print("No profiles found with matching MD5s. No matched file written.")
+        return matches_found
+
+    except Exception as err:
+        print(f"Failed to compare MD5s or write matched profile data: {err}")
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Match container profile process MD5s against suspicious binary incidents")
+    parser.add_argument('--all-process-md5s', action='store_true', default=JOIN_ALL_PROCESS_MD5S,
+                        help="join on every static process MD5 of a profile, not just the first one")
+    parser.add_argument('--store', default=SNAPSHOT_DB, help="snapshot database (default: %(default)s)")
+    parser.add_argument('--full', action='store_true',
+                        help="ignore the incident high-water mark and re-fetch the whole incident window")
+    args = parser.parse_args(argv)
+
+    # Load Session
+    try:
+        cwp_session = load_session()
+    except Exception as e:
+        print(f"Failed to load or authenticate session: {e}")
+        return 1
+
+    store = SnapshotStore(args.store)
+    try:
+        if not sync_snapshot(cwp_session, store, args.full) or not write_outputs(store):
+            return 1
+        if write_matches(store, args.all_process_md5s) is None:
+            return 1
+    finally:
+        store.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
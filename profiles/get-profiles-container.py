@@ -1,19 +1,25 @@
-import csv
-import json
+import argparse
 import logging
 import os
-from pcpi import session_loader
-from time import sleep
+import sys
 
-# Setup Logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pc_common import ColumnarSink, JsonSink, Paginator, Projection, TokenBucket
 
-# Output format: "csv" or "json"
+# Output format: "csv", "json", "parquet" or "arrow" (the last two need pyarrow and fall back to CSV without it)
 OUTPUT_FORMAT = 'csv'
-OUTPUT_FILE = f"container_profiles_output.{OUTPUT_FORMAT}"
+OUTPUT_FILE = "container_profiles_output.{fmt}"
+
+# Write one row per processes.static entry instead of only each profile's first process
+EXPLODE_PROCESSES = False
+
+# Columnar formats: repeated low-cardinality columns are dictionary-encoded, flags are stored as booleans
+DICTIONARY_FIELDS = ['image', 'cluster', 'namespace']
+BOOL_FIELDS = ['learnedStartup', 'archived', 'infra']
+
+# Pagination: pages kept in flight, and a requests/second ceiling to be polite to the API
+PAGE_WINDOW = 4
+API_RATE = 4
 
 # Target fields to extract
 TARGET_FIELDS = [
@@ -22,85 +28,104 @@ TARGET_FIELDS = [
     'processes.static.md5', 'imageID', 'namespace', 'cluster', 'accountIDs'
 ]
 
-# Utility to safely extract nested fields
-def get_nested(data, path):
-    keys = path.split('.')
-    for key in keys:
-        if isinstance(data, list):
-            data = data[0] if data else {}
-        data = data.get(key, {})
-    return data if not isinstance(data, dict) else ""
-
-def extract_fields(profile):
-    flat = {}
-    for field in TARGET_FIELDS:
-        flat[field] = get_nested(profile, field)
+# Field paths are compiled once and applied to each page as a batch
+PROJECTION = Projection(TARGET_FIELDS, explode='processes.static')
+
+def extract_fields(batch, explode_processes=EXPLODE_PROCESSES):
+    rows = PROJECTION.explode_many(batch) if explode_processes else PROJECTION.project_many(batch)
     # accountIDs may be a list; join if needed
-    if isinstance(flat.get("accountIDs"), list):
-        flat["accountIDs"] = ",".join(flat["accountIDs"])
-    return flat
+    for row in rows:
+        if isinstance(row.get("accountIDs"), list):
+            row["accountIDs"] = ",".join(row["accountIDs"])
+    return rows
 
-# Load Session
-try:
+def open_sink(fmt=OUTPUT_FORMAT, output=None):
+    path = output or OUTPUT_FILE.format(fmt=fmt)
+    if fmt == 'json':
+        return JsonSink(path, fmt='json')
+    return ColumnarSink(path, TARGET_FIELDS, fmt=fmt,
+                        dictionary_columns=DICTIONARY_FIELDS, bool_columns=BOOL_FIELDS)
+
+def load_session():
+    # pcpi is only needed to talk to the API, so --help works without it
+    from pcpi import session_loader
     logging.info("Loading session...")
     session_managers = session_loader.load_config()
     session_man = session_managers[0]
-    cwp_session = session_man.create_cwp_session()
-except Exception as e:
-    logging.error(f"Failed to load or authenticate session: {e}")
-    exit(1)
+    return session_man.create_cwp_session()
 
-# Main logic to paginate and fetch all entries
-all_profiles = []
-limit = 100  # reasonable batch size
-offset = 0
+"""
+Page through every container profile and stream the rows into the output file.
+Returns the number of rows written
+"""
+def export_profiles(cwp_session, fmt=OUTPUT_FORMAT, explode_processes=EXPLODE_PROCESSES, output=None):
+    limit = 100  # reasonable batch size
+    offset = 0
 
-try:
     # First call to get total count
     logging.info("Fetching initial batch to get total count...")
     res = cwp_session.request(
         'GET',
         f'/api/v1/profiles/container?limit={limit}&offset={offset}&project=Central+Console&reverse=false'
     )
+    res.raise_for_status()
     total_count = int(res.headers.get("Total-Count", 0))
     logging.info(f"Total profiles to fetch: {total_count}")
 
-    while offset < total_count:
-        logging.info(f"Fetching records {offset + 1} to {offset + limit}...")
+    def fetch_page(index, size):
+        page_offset = index * size
+        logging.info(f"Fetching records {page_offset + 1} to {page_offset + size}...")
+        res = cwp_session.request(
+            'GET',
+            f'/api/v1/profiles/container?limit={size}&offset={page_offset}&project=Central+Console&reverse=false'
+        )
+        res.raise_for_status()
+        return res.json() or []
+
+    # The count probe already returned the first page; don't request it again
+    pages = Paginator(fetch_page, page_size=limit, window=PAGE_WINDOW, total=total_count,
+                      limiter=TokenBucket(API_RATE), first_page=res.json() or [])
+
+    # Rows are streamed into the output file page by page rather than collected first
+    with open_sink(fmt, output) as sink:
         try:
-            res = cwp_session.request(
-                'GET',
-                f'/api/v1/profiles/container?limit={limit}&offset={offset}&project=Central+Console&reverse=false'
-            )
-            res.raise_for_status()
-            batch = res.json()
-            for profile in batch:
-                all_profiles.append(extract_fields(profile))
+            for batch in pages:
+                sink.write_many(extract_fields(batch, explode_processes))
         except Exception as err:
-            logging.error(f"Error fetching batch at offset {offset}: {err}")
-            break
-        offset += limit
-        sleep(0.5)  # be polite to the API
-
-    logging.info(f"Total records fetched: {len(all_profiles)}")
-
-except Exception as err:
-    logging.error(f"Failed during data retrieval: {err}")
-    exit(1)
-
-# Output the result
-try:
-    if OUTPUT_FORMAT == "json":
-        with open(OUTPUT_FILE, "w") as f:
-            json.dump(all_profiles, f, indent=4)
-    else:
-        with open(OUTPUT_FILE, "w", newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=TARGET_FIELDS)
-            writer.writeheader()
-            writer.writerows(all_profiles)
-
-    logging.info(f"Data written to {OUTPUT_FILE}")
-
-except Exception as err:
-    logging.error(f"Failed to write output file: {err}")
-    exit(1)
+            logging.error(f"Error fetching batch at offset {pages.pages_done * limit}: {err}")
+
+    logging.info(f"Total rows written: {sink.count}")
+    logging.info(f"Data written to {sink.path}")
+    return sink.count
+
+def main(argv=None):
+    # Setup Logging
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+
+    parser = argparse.ArgumentParser(description="Export container runtime profiles")
+    parser.add_argument('--format', choices=['csv', 'json', 'parquet', 'arrow'], default=OUTPUT_FORMAT,
+                        help="output format (default: %(default)s)")
+    parser.add_argument('--explode-processes', action='store_true', default=EXPLODE_PROCESSES,
+                        help="one row per (profile, static process) instead of one row per profile")
+    parser.add_argument('--output', help="output file (default: container_profiles_output.<format>)")
+    args = parser.parse_args(argv)
+
+    # Load Session
+    try:
+        cwp_session = load_session()
+    except Exception as e:
+        logging.error(f"Failed to load or authenticate session: {e}")
+        return 1
+
+    try:
+        export_profiles(cwp_session, args.format, args.explode_processes, args.output)
+    except Exception as err:
+        logging.error(f"Failed during data retrieval: {err}")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
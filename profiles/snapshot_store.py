@@ -0,0 +1,175 @@
+"""
+Local SQLite snapshot of container profiles and suspicious-binary incidents.
+
+Profiles are keyed on `_id` and carry a content hash of the API record, so a refresh
+only rewrites profiles whose content changed and prunes the ones the API no longer
+returns. Incidents are keyed on `_id` and only fetched past the stored high-water mark.
+Flattened rows are stored alongside their MD5 (indexed), so the MD5 match is a join
+inside the store rather than a pass over freshly fetched lists.
+"""
+import hashlib
+import json
+import sqlite3
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS profiles (
+    id TEXT PRIMARY KEY,
+    hash TEXT,
+    seen INTEGER,
+    md5 TEXT,
+    row TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_profiles_md5 ON profiles (md5);
+CREATE TABLE IF NOT EXISTS processes (
+    profile_id TEXT,
+    position INTEGER,
+    md5 TEXT,
+    row TEXT,
+    PRIMARY KEY (profile_id, position)
+);
+CREATE INDEX IF NOT EXISTS idx_processes_md5 ON processes (md5);
+CREATE TABLE IF NOT EXISTS incidents (
+    id TEXT PRIMARY KEY,
+    time TEXT,
+    md5 TEXT,
+    row TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_incidents_md5 ON incidents (md5);
+CREATE INDEX IF NOT EXISTS idx_incidents_time ON incidents (time);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+MD5_FIELD = 'processes.static.md5'
+
+
+def content_hash(record):
+    return hashlib.sha1(json.dumps(record, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
+
+class SnapshotStore:
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def get_meta(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        self.conn.execute("INSERT INTO meta (key, value) VALUES (?, ?) "
+                          "ON CONFLICT(key) DO UPDATE SET value = excluded.value", (key, str(value)))
+
+    def counts(self):
+        return {table: self.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table in ('profiles', 'processes', 'incidents')}
+
+    # Profiles
+
+    def begin_profile_sync(self):
+        generation = int(self.get_meta('profile_generation', 0)) + 1
+        with self.conn:
+            self.set_meta('profile_generation', generation)
+        return generation
+
+    def upsert_profiles(self, profiles, generation):
+        """
+        `profiles` is a list of (profile_id, content_hash, row, process_rows). Returns
+        (new, changed); unchanged profiles only get their generation bumped.
+        """
+        ids = [p[0] for p in profiles]
+        existing = {}
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            existing.update(self.conn.execute(
+                f"SELECT id, hash FROM profiles WHERE id IN ({','.join('?' * len(chunk))})", chunk).fetchall())
+        dirty = [p for p in profiles if existing.get(p[0]) != p[1]]
+        with self.conn:
+            self.conn.executemany("UPDATE profiles SET seen = ? WHERE id = ?",
+                                  [(generation, p[0]) for p in profiles if existing.get(p[0]) == p[1]])
+            self.conn.executemany(
+                "INSERT INTO profiles (id, hash, seen, md5, row) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET hash = excluded.hash, seen = excluded.seen, "
+                "md5 = excluded.md5, row = excluded.row",
+                [(pid, h, generation, row.get(MD5_FIELD) or None, json.dumps(row)) for pid, h, row, _ in dirty])
+            self.conn.executemany("DELETE FROM processes WHERE profile_id = ?", [(p[0],) for p in dirty])
+            self.conn.executemany(
+                "INSERT INTO processes (profile_id, position, md5, row) VALUES (?, ?, ?, ?)",
+                [(pid, i, prow.get(MD5_FIELD) or None, json.dumps(prow))
+                 for pid, _, _, process_rows in dirty for i, prow in enumerate(process_rows)])
+        new = sum(1 for p in dirty if p[0] not in existing)
+        return new, len(dirty) - new
+
+    def finish_profile_sync(self, generation):
+        """Drop profiles not seen in this (complete) walk. Returns the number removed."""
+        with self.conn:
+            self.conn.execute("DELETE FROM processes WHERE profile_id IN "
+                              "(SELECT id FROM profiles WHERE seen < ?)", (generation,))
+            removed = self.conn.execute("DELETE FROM profiles WHERE seen < ?", (generation,)).rowcount
+            self.set_meta('profiles_synced', time.time())
+        return removed
+
+    def profile_rows(self):
+        for (row,) in self.conn.execute("SELECT row FROM profiles ORDER BY id"):
+            yield json.loads(row)
+
+    # Incidents
+
+    def incident_high_water(self):
+        return self.get_meta('incident_high_water')
+
+    def add_incidents(self, incidents):
+        """`incidents` is a list of (incident_id, time, row). Returns the number not already stored."""
+        before = self.conn.total_changes
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO incidents (id, time, md5, row) VALUES (?, ?, ?, ?)",
+                [(iid, t, row.get('md5') or None, json.dumps(row)) for iid, t, row in incidents])
+        return self.conn.total_changes - before
+
+    def finish_incident_sync(self, high_water, retain_from):
+        """Advance the high-water mark and drop incidents older than `retain_from`. Returns the number dropped."""
+        with self.conn:
+            if high_water:
+                current = self.incident_high_water()
+                self.set_meta('incident_high_water', max(high_water, current) if current else high_water)
+            return self.conn.execute("DELETE FROM incidents WHERE time < ?", (retain_from,)).rowcount
+
+    def reset_incidents(self):
+        with self.conn:
+            self.conn.execute("DELETE FROM incidents")
+            self.conn.execute("DELETE FROM meta WHERE key = 'incident_high_water'")
+
+    def incident_rows(self):
+        for (row,) in self.conn.execute("SELECT row FROM incidents ORDER BY time, id"):
+            yield json.loads(row)
+
+    # Matching
+
+    def matches(self, all_processes=False):
+        """
+        Yield (profile_row, incident_row) for every profile row sharing an MD5 with a stored
+        incident: each profile's first static process, or every static process.
+        """
+        if all_processes:
+            query = ("SELECT p.row, i.row FROM processes p JOIN incidents i ON i.md5 = p.md5 "
+                     "ORDER BY p.profile_id, p.position, i.time, i.id")
+        else:
+            query = ("SELECT p.row, i.row FROM profiles p JOIN incidents i ON i.md5 = p.md5 "
+                     "ORDER BY p.id, i.time, i.id")
+        for profile_row, incident_row in self.conn.execute(query):
+            yield json.loads(profile_row), json.loads(incident_row)
@@ -1,17 +1,15 @@
+import argparse
 import json
 import os
 import sys
 import requests as req
+from pc_common import get_client
 
 api = os.getenv('PRISMA_API_URL')
 username = os.getenv('PRISMA_ACCESS_KEY_ID')
 password = os.getenv('PRISMA_SECRET_KEY')
 role = os.getenv('PRISMA_ROLE')
 
-if api is None or username is None or password is None:
-    print('Missing environment variables')
-    sys.exit(1)
-
 class Colors:
     RED = '\033[91m'
     GREEN = '\033[92m'
@@ -21,41 +19,18 @@ class Colors:
 def color_print(text, color):
     print(color + text + Colors.END)
 
-def authenticate():
-    try:
-        payload = {'username': username, 'password': password}
-        headers = {'Content-Type': 'application/json; charset=UTF-8', 'Accept': 'application/json; charset=UTF-8'}
-        result = req.post(f"{api}/login", data=json.dumps(payload), headers=headers, timeout=30)
-        result.raise_for_status()
-        return result.json()['token']
-    except req.exceptions.RequestException as e:
-        print(f"Error: {e}")
-        sys.exit(1)
-
-def create_headers(token):
-    try:
-        return {'Content-Type': 'application/json; charset=UTF-8', 'Accept': 'application/json; charset=UTF-8',
-                'x-redlock-auth': token}
-    except Exception as e:
-        print(f"Error: {e}")
-        sys.exit(1)
-
-def make_request(method, endpoint, payload=None):
-    try:
-        token = authenticate()
-        headers = create_headers(token)
-        if method == "GET":
-            result = req.get(f"{api}/{endpoint}", headers=headers, timeout=30)
-        else:
-            result = req.put(f"{api}/{endpoint}", headers=headers, data=json.dumps(payload), timeout=30)
-        result.raise_for_status()
-        return result
-    except req.exceptions.RequestException as e:
-        print(f"Error: {e}")
-        sys.exit(1)
+"""
+Send a request through the shared client; raises requests.RequestException when it fails,
+so one failed role update doesn't end the run
+"""
+def make_request(method, endpoint, payload=None, cache=True):
+    # cache=False bypasses the response cache for this request only (--no-cache)
+    result = get_client().request(method, endpoint, payload, cache=cache)
+    result.raise_for_status()
+    return result
 
-def get_repos():
-    response = make_request("GET", "code/api/v2/repositories")
+def get_repos(cache=True):
+    response = make_request("GET", "code/api/v2/repositories", cache=cache)
     repo_ids = []
 
     data = response.json()['repositories']
@@ -64,43 +39,120 @@ def get_repos():
         repo_ids.append(item.get('id'))
     return repo_ids
 
+"""
+Role names to update. PRISMA_ROLE may hold one name, a comma-separated or JSON list of
+names, or the path of a JSON config file containing a list or {"roles": [...]}
+"""
+def parse_roles(value):
+    if not value:
+        return []
+    if os.path.isfile(value):
+        with open(value, 'r') as f:
+            config = json.load(f)
+        names = config.get('roles', []) if isinstance(config, dict) else config
+    elif value.strip().startswith('['):
+        names = json.loads(value)
+    else:
+        names = value.split(',')
+    return [name.strip() for name in names if name and name.strip()]
+
+def get_roles(cache=True):
+    data = make_request("GET", "user/role", cache=cache)
+    return {item.get('name'): item for item in data.json()}
+
 def get_role_id(role):
     try:
-        data = make_request("GET", "user/role")
-        for item in data.json():
-            if item.get('name') == role:
-                return {
-                    "id": item.get('id'),
-                    "roleType": item.get('roleType')
-                }
+        item = get_roles().get(role)
+        if item is not None:
+            return {
+                "id": item.get('id'),
+                "roleType": item.get('roleType')
+            }
         # If 'specified role' not found, return None
         return None
     except Exception as e:
         print(f"Error: {e}")
         sys.exit(1)
 
+"""
+Repositories currently assigned to a role; read from the role listing when it carries them
+"""
+def get_role_repos(item, cache=True):
+    if 'codeRepositoryIds' not in item:
+        item = make_request("GET", f"user/role/{item.get('id')}", cache=cache).json()
+    return item.get('codeRepositoryIds') or []
 
-
-def assign_repos():
-    try:
-        role_id = get_role_id(role)
-        repos_id = get_repos()
+"""
+Assign every onboarded repository to each role. The repository list is fetched once and
+compared with each role's current assignment; roles that already match are not updated.
+`replace` PUTs every role regardless, `dry_run` only prints the differences.
+Returns ({role: response}, {role: error}); a missing or failed role doesn't stop the others
+"""
+def assign_repos(roles=None, replace=False, dry_run=False, cache=True):
+    results, failed = {}, {}
+    roles = roles or parse_roles(role)
+    if not roles:
+        raise ValueError('No role given; set PRISMA_ROLE')
+    role_items = get_roles(cache)
+    repos_id = get_repos(cache)
+    wanted = set(repos_id)
+    for name in roles:
+        item = role_items.get(name)
+        if item is None:
+            color_print(f"Role '{name}' not found", Colors.RED)
+            failed[name] = 'not found'
+            continue
+        try:
+            current = set(get_role_repos(item, cache))
+        except req.exceptions.RequestException as e:
+            color_print(f"{name}: could not read its repositories ({e})", Colors.RED)
+            failed[name] = str(e)
+            continue
+        to_add, to_remove = wanted - current, current - wanted
+        if not (to_add or to_remove or replace):
+            color_print(f"{name}: already has all {len(current)} repositories, skipping", Colors.GREEN)
+            continue
+        color_print(f"{name}: {len(to_add)} to add, {len(to_remove)} to remove", Colors.YELLOW)
+        if dry_run:
+            continue
+        # The role update replaces the whole assignment, so a changed role gets the full list
         payload = {
-            "accountGroupIds": [],
-            "resourceListIds": [],
-            "roleType": role_id['roleType'], 
+            "accountGroupIds": item.get('accountGroupIds') or [],
+            "resourceListIds": item.get('resourceListIds') or [],
+            "roleType": item.get('roleType'),
             "codeRepositoryIds": repos_id
             }
-        result = make_request("PUT", f"user/role/{role_id['id']}", payload)
-        return result
-    except Exception as e:
-        print(f"Error: {e}")
-        color_print('Error assigning repositories', Colors.RED)
+        try:
+            results[name] = make_request("PUT", f"user/role/{item.get('id')}", payload)
+        except req.exceptions.RequestException as e:
+            color_print(f"{name}: update failed ({e})", Colors.RED)
+            failed[name] = str(e)
+    return results, failed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Assign all onboarded repositories to one or more roles")
+    parser.add_argument('--replace', action='store_true', help="update every role even when nothing changed")
+    parser.add_argument('--dry-run', action='store_true', help="only print what would be added and removed")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="bypass the PRISMA_HTTP_CACHE response cache and query the API directly")
+    args = parser.parse_args(argv)
+
+    if api is None or username is None or password is None:
+        print('Missing environment variables')
+        return 1
 
-if __name__ == '__main__':
     color_print('CAS - Assign all onboarded Repos to Developer role - 0.0.1', Colors.GREEN)
     try:
-        assign_repos()
-        color_print('Done', Colors.GREEN)
+        _, failed = assign_repos(replace=args.replace, dry_run=args.dry_run, cache=not args.no_cache)
     except Exception as e:
-        color_print(f"Error: {e}", Colors.RED)
\ No newline at end of file
+        color_print(f"Error: {e}", Colors.RED)
+        color_print('Error assigning repositories', Colors.RED)
+        return 1
+    if failed:
+        color_print(f"Finished with errors: {', '.join(failed)}", Colors.RED)
+        return 1
+    color_print('Done', Colors.GREEN)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,126 @@
+"""
+Local SQLite copy of the CAS dependency inventory fetched in step 1.
+
+Records are keyed on `id` and indexed on (name, version), so step 2 can look up just
+the packages named in the rules instead of reloading the whole inventory. Each sync
+only writes rows that are new or whose content changed, and prunes rows the API no
+longer returns once a walk completes.
+"""
+import hashlib
+import json
+import sqlite3
+import time
+
+from version_match import DependencyIndex
+
+FIELDS = ('id', 'name', 'version', 'origin')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dependencies (
+    id TEXT PRIMARY KEY,
+    name TEXT,
+    version TEXT,
+    origin TEXT,
+    hash TEXT,
+    seen INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_dependencies_name_version ON dependencies (name, version);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def record_hash(record):
+    return hashlib.sha1(json.dumps([record.get(f) for f in FIELDS]).encode()).hexdigest()
+
+
+class DependencyStore:
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def get_meta(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        self.conn.execute("INSERT INTO meta (key, value) VALUES (?, ?) "
+                          "ON CONFLICT(key) DO UPDATE SET value = excluded.value", (key, str(value)))
+
+    def count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM dependencies").fetchone()[0]
+
+    def last_synced(self):
+        value = self.get_meta('last_synced')
+        return float(value) if value else None
+
+    def is_fresh(self, max_age):
+        last = self.last_synced()
+        return last is not None and time.time() - last < max_age
+
+    def begin_sync(self, resume=False):
+        """Start (or, when resuming, continue) a sync generation and return its number."""
+        current = self.get_meta('sync_generation')
+        if resume and current is not None:
+            return int(current)
+        # A fresh walk must not reuse the number an abandoned one already stamped rows with,
+        # or finish_sync would keep rows the new walk never saw
+        generation = max(int(current or 0), int(self.get_meta('last_generation', 0))) + 1
+        with self.conn:
+            self.set_meta('sync_generation', generation)
+        return generation
+
+    def upsert(self, records, generation):
+        """Write a page of records; returns (new, changed) counts. Unchanged rows only get their generation bumped."""
+        rows = [(r.get('id'),) + tuple(r.get(f) for f in FIELDS[1:]) + (record_hash(r), generation)
+                for r in records if r.get('id') not in (None, 'N/A')]
+        if not rows:
+            return 0, 0
+        ids = [row[0] for row in rows]
+        existing = {}
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            existing.update(self.conn.execute(
+                f"SELECT id, hash FROM dependencies WHERE id IN ({','.join('?' * len(chunk))})", chunk).fetchall())
+        dirty = [row for row in rows if existing.get(row[0]) != row[4]]
+        unchanged = [(generation, row[0]) for row in rows if existing.get(row[0]) == row[4]]
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO dependencies (id, name, version, origin, hash, seen) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET name = excluded.name, version = excluded.version, "
+                "origin = excluded.origin, hash = excluded.hash, seen = excluded.seen",
+                dirty)
+            self.conn.executemany("UPDATE dependencies SET seen = ? WHERE id = ?", unchanged)
+        new = sum(1 for row in dirty if row[0] not in existing)
+        return new, len(dirty) - new
+
+    def finish_sync(self, generation):
+        """Drop rows not seen in this (complete) walk and stamp the sync time. Returns the number removed."""
+        with self.conn:
+            removed = self.conn.execute("DELETE FROM dependencies WHERE seen < ?", (generation,)).rowcount
+            self.set_meta('last_generation', generation)
+            self.set_meta('last_synced', time.time())
+            self.conn.execute("DELETE FROM meta WHERE key = 'sync_generation'")
+        return removed
+
+    def index_for(self, packages):
+        """DependencyIndex holding only the given package names, read through the (name, version) index."""
+        index = DependencyIndex()
+        for name in set(packages):
+            for version, dep_id in self.conn.execute(
+                    "SELECT version, id FROM dependencies WHERE name = ?", (name,)):
+                index.add(name, version, dep_id)
+        return index
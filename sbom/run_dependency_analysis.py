@@ -1,10 +1,17 @@
 
+import argparse
 import json
 import os
+import sys
 import logging
-from time import sleep
-from pcpi import session_loader
-from concurrent.futures import ThreadPoolExecutor, TimeoutError
+import requests as req
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [SCRIPT_DIR, os.path.join(SCRIPT_DIR, '..')]
+from pc_common import (Checkpoint, JsonSink, PageFetchError, Paginator, PrismaClient, RetryPolicy, Throughput,
+                       TokenBucket, iter_records, map_ordered)
+from dependency_store import DependencyStore
+from version_match import DependencyIndex, match_rules
 
 # ==============================================================================
 # 📜 --- SCRIPT CONFIGURATION ---
@@ -12,14 +19,24 @@ from concurrent.futures import ThreadPoolExecutor, TimeoutError
 
 # --- File Configuration ---
 RULES_FILE = 'output.json'
-DEPENDENCIES_FILE = 'cas_dependencies.json'
+DEPENDENCIES_FORMAT = 'jsonl'  # 'jsonl' (compact, one record per line) or 'json' (indented array)
+DEPENDENCIES_FILE = f'cas_dependencies.{DEPENDENCIES_FORMAT}'
 MATCHED_IDS_FILE = 'matched_ids.json'
 FINAL_OUTPUT_FILE = 'source_locations.json'
+CHECKPOINT_FILE = 'workflow_checkpoint.json'
+DEPENDENCY_DB = 'cas_dependencies.db'  # Local SQLite index of the step 1 inventory
+SYNC_MAX_AGE = 24 * 3600               # '--sync auto' reuses the local index if it is younger than this (seconds)
 
 # --- API Performance & Stability Configuration ---
 API_LIMIT = 50
-REQUEST_TIMEOUT = 30  # Timeout in seconds for each API request
-API_DELAY = 0.3       # Delay between API calls to avoid rate-limiting
+API_MAX_LIMIT = 1000  # Largest page size to try; the largest one the server accepts is used
+PAGE_WINDOW = 4       # Dependency pages kept in flight at once (step 1)
+CONNECT_TIMEOUT = 10  # Seconds to establish a connection
+REQUEST_TIMEOUT = 30  # Seconds to wait for the server to send data (read timeout)
+MAX_RETRIES = 4       # Retries on timeouts, connection errors, 429 and 502/503/504, with backoff + jitter
+CONCURRENCY = 8       # Parallel workers for the per-ID source location lookups (step 3)
+API_RATE = 10         # Max requests per second across all workers, to avoid rate-limiting
+STEP3_CHUNK = 200     # Step 3 IDs processed (and checkpointed) per batch
 
 
 file_path = os.path.join(os.path.expanduser("~"), ".prismacloud", "credentials.json")
@@ -36,97 +53,152 @@ formatter = logging.Formatter('%(asctime)s - %(message)s', datefmt='%Y-%m-%d %H:
 handler.setFormatter(formatter)
 script_logger.addHandler(handler)
 
-# 2. Silence the noisy pcpi library logger by setting its level higher
-logging.getLogger('pcpi').setLevel(logging.WARNING)
+# 2. Silence the noisy urllib3 connection pool logger by setting its level higher
+logging.getLogger('urllib3').setLevel(logging.WARNING)
 
 # ==============================================================================
 # 🌐 --- API HELPER FUNCTION ---
 # ==============================================================================
 
 def make_api_request(session, method, endpoint, **kwargs):
-    """A robust wrapper for making API requests with cross-platform timeouts and JSON validation."""
+    """Make an API request and validate the JSON response. Timeouts and retries are handled by the session's transport."""
     try:
-        with ThreadPoolExecutor(max_workers=1) as executor:
-            future = executor.submit(session.request, method, endpoint, **kwargs)
-            res = future.result(timeout=REQUEST_TIMEOUT)
-
-        if res is None:
-            raise ConnectionError("API call failed and returned None after internal retries.")
+        res = session.request(method, endpoint, **kwargs)
         res.raise_for_status()
         if 'application/json' not in res.headers.get('Content-Type', ''):
             raise ValueError(f"Expected JSON but received '{res.headers.get('Content-Type')}'")
         return res.json()
 
-    except TimeoutError:
-        script_logger.error(f"   -> [✖︎] API call to '{endpoint}' timed out after {REQUEST_TIMEOUT} seconds.")
+    except req.exceptions.Timeout:
+        script_logger.error(f"   -> [✖︎] API call to '{endpoint}' timed out after {REQUEST_TIMEOUT} seconds ({MAX_RETRIES} retries).")
         return None
     except Exception as e:
         script_logger.error(f"   -> [✖︎] API call to '{endpoint}' failed: {e}")
         return None
 
+
+def create_session(concurrency=CONCURRENCY):
+    """Pooled API client from the credentials file, sized for the step 1/step 3 worker counts."""
+    return PrismaClient.from_credentials_file(
+        file_path,
+        pool_size=max(concurrency, PAGE_WINDOW) + 2,
+        timeout=(CONNECT_TIMEOUT, REQUEST_TIMEOUT),
+        retry=RetryPolicy(retries=MAX_RETRIES),
+    )
+
+
+def log_endpoint_stats(session):
+    script_logger.info(" [📊] API calls per endpoint:")
+    for line in session.stats.lines():
+        script_logger.info(f"    -> {line}")
+
 # ==============================================================================
 # ⚙️ --- STEP 1: FETCH ALL CAS DEPENDENCIES ---
 # ==============================================================================
 
-def fetch_all_dependencies(session):
+def fetch_all_dependencies(session, output_file=DEPENDENCIES_FILE, output_format=DEPENDENCIES_FORMAT, checkpoint=None,
+                           store=None, sync='delta'):
     script_logger.info("==========================================================")
     script_logger.info(" [▶︎] STEP 1: Fetching all CAS dependencies...")
     script_logger.info("==========================================================")
     
-    all_dependencies, current_page = [], 0
     target_fields = ['id', 'name', 'version', 'origin']
+    if store is not None and sync != 'delta' and store.count():
+        if sync == 'skip' or store.is_fresh(SYNC_MAX_AGE):
+            script_logger.info(f" [⏭︎] Using the local index '{store.path}' ({store.count()} dependencies), no sync needed.")
+            return True
+    elif store is not None and sync == 'skip':
+        script_logger.error(f" [✖︎] '--sync skip' needs a populated local index, but '{store.path}' is empty.")
+        return False
+    progress = checkpoint.get('step1', {}) if checkpoint else {}
+    if progress.get('file') != output_file:
+        progress = {}
+    if progress.get('done'):
+        script_logger.info(f" [⏭︎] Already completed: {progress['records']} dependencies in '{output_file}'.")
+        return True
 
-    while True:
-        script_logger.info(f" [🔄] Fetching page {current_page}...")
-        batch_data = make_api_request(
+    def fetch_page(page, limit):
+        script_logger.info(f" [🔄] Fetching page {page} (limit {limit})...")
+        return make_api_request(
             session, 'POST', '/bridgecrew/api/v1/sbom/dependencies',
-            params={'page': current_page, 'limit': API_LIMIT},
+            params={'page': page, 'limit': limit},
             json={'filters': {}}
         )
-        if batch_data is None:
-            script_logger.error(" [✖︎] Halting dependency fetch due to API error.")
-            return False
-        if not batch_data:
-            script_logger.info(" [✔︎] Reached the last page. No more dependencies to fetch.")
-            break
-        for dep in batch_data:
-            all_dependencies.append({field: dep.get(field, 'N/A') for field in target_fields})
-        script_logger.info(f"    -> Fetched {len(batch_data)} records. Total now: {len(all_dependencies)}")
-        current_page += 1
-        sleep(API_DELAY)
 
+    start, records = progress.get('pages_done', 0), progress.get('records', 0)
+    generation = store.begin_sync(resume=bool(start)) if store is not None else None
+    new = changed = 0
+    pages = Paginator(fetch_page, page_size=progress.get('page_size', API_LIMIT), max_page_size=API_MAX_LIMIT,
+                      window=PAGE_WINDOW, start=start, limiter=TokenBucket(API_RATE))
+    if start:
+        script_logger.info(f" [⏩] Resuming at page {start} with {records} dependencies already saved.")
     try:
-        with open(DEPENDENCIES_FILE, "w") as f:
-            json.dump(all_dependencies, f, indent=4)
-        script_logger.info(f" [💾] SUCCESS: Saved {len(all_dependencies)} dependencies to '{DEPENDENCIES_FILE}'")
+        # Each page is written (and flushed) as it arrives, so memory stays flat and a
+        # failure part way leaves everything fetched so far on disk.
+        with JsonSink(output_file, output_format, resume_at=progress.get('offset') if start else None) as sink:
+            try:
+                for batch_data in pages:
+                    page_records = [{field: dep.get(field, 'N/A') for field in target_fields} for dep in batch_data]
+                    sink.write_many(page_records)
+                    if store is not None:
+                        page_new, page_changed = store.upsert(page_records, generation)
+                        new, changed = new + page_new, changed + page_changed
+                    records += len(batch_data)
+                    script_logger.info(f"    -> Fetched {len(batch_data)} records. Total now: {records}")
+                    if checkpoint:
+                        checkpoint.update('step1', file=output_file, page_size=pages.page_size,
+                                          pages_done=pages.pages_done, offset=sink.tell(), records=records)
+            except PageFetchError:
+                script_logger.error(f" [✖︎] Halting dependency fetch due to API error. {records} records kept in '{output_file}'.")
+                return False
+        if store is not None:
+            removed = store.finish_sync(generation)
+            script_logger.info(f" [🗂️] Local index '{store.path}': {new} new, {changed} changed, {removed} removed.")
+        if checkpoint:
+            checkpoint.update('step1', file=output_file, records=records, done=True)
+        script_logger.info(f" [✔︎] Reached the last page ({pages.pages_done} pages of up to {pages.page_size}). No more dependencies to fetch.")
+        script_logger.info(f" [💾] SUCCESS: Saved {records} dependencies to '{output_file}'")
         return True
     except Exception as err:
-        script_logger.error(f" [✖︎] FAILED to write dependencies to '{DEPENDENCIES_FILE}': {err}")
+        script_logger.error(f" [✖︎] FAILED to write dependencies to '{output_file}': {err}")
         return False
 
 # ==============================================================================
 # 🔗 --- STEP 2: MATCH RULES TO DEPENDENCIES ---
 # ==============================================================================
 
-def match_rules_to_dependencies():
+def match_rules_to_dependencies(dependencies_file=DEPENDENCIES_FILE, checkpoint=None, store=None):
     script_logger.info("==========================================================")
     script_logger.info(" [▶︎] STEP 2: Matching rules to find package IDs...")
     script_logger.info("==========================================================")
 
+    if checkpoint and checkpoint.get('step2', {}).get('done') and os.path.exists(MATCHED_IDS_FILE):
+        script_logger.info(f" [⏭︎] Already completed: matched IDs are in '{MATCHED_IDS_FILE}'.")
+        return True
     try:
         script_logger.info(f" [📄] Loading rules from '{RULES_FILE}'...")
         with open(RULES_FILE, 'r') as f:
             rules = json.load(f).get('rules', [])
         script_logger.info(f"    -> Loaded {len(rules)} rules.")
-        script_logger.info(f" [📄] Loading dependencies from '{DEPENDENCIES_FILE}'...")
-        with open(DEPENDENCIES_FILE, 'r') as f:
-            dependencies = json.load(f)
-        script_logger.info(f"    -> Loaded {len(dependencies)} dependencies.")
-        dependency_map = {(dep['name'], dep['version']): dep.get('id') for dep in dependencies if 'name' in dep and 'version' in dep}
-        matched_ids = [dependency_map[key] for rule in rules if (key := (rule.get('package'), rule.get('minVersionInclusive'))) in dependency_map]
-        script_logger.info(f" [🎯] Found {len(matched_ids)} matches out of {len(rules)} rules.")
+        if store is not None and store.count():
+            script_logger.info(f" [🗂️] Querying the local index '{store.path}'...")
+            index = store.index_for(rule.get('package') for rule in rules)
+            script_logger.info(f"    -> Loaded {len(index)} dependencies for the rule packages.")
+        else:
+            script_logger.info(f" [📄] Loading dependencies from '{dependencies_file}'...")
+            index, loaded = DependencyIndex(), 0
+            for dep in iter_records(dependencies_file):
+                loaded += 1
+                if 'name' in dep and 'version' in dep:
+                    index.add(dep['name'], dep['version'], dep.get('id'))
+            script_logger.info(f"    -> Loaded {loaded} dependencies.")
+        # Each rule matches every version in [minVersionInclusive, maxVersionInclusive]
+        matched_ids = match_rules(index, rules)
+        script_logger.info(f" [🎯] Found {len(matched_ids)} matching package IDs for {len(rules)} rules.")
         with open(MATCHED_IDS_FILE, 'w') as f:
             json.dump(matched_ids, f, indent=4)
+        if checkpoint:
+            checkpoint.update('step2', done=True, matches=len(matched_ids))
         script_logger.info(f" [💾] SUCCESS: Saved {len(matched_ids)} matched IDs to '{MATCHED_IDS_FILE}'")
         return True
     except FileNotFoundError as e:
@@ -140,7 +212,7 @@ def match_rules_to_dependencies():
 # 📍 --- STEP 3: FETCH SOURCE LOCATIONS FOR MATCHED IDS ---
 # ==============================================================================
 
-def fetch_source_locations_for_ids(session):
+def fetch_source_locations_for_ids(session, concurrency=CONCURRENCY, rate=API_RATE, checkpoint=None):
     script_logger.info("==========================================================")
     script_logger.info(" [▶︎] STEP 3: Fetching source locations for matched IDs...")
     script_logger.info("==========================================================")
@@ -153,20 +225,41 @@ def fetch_source_locations_for_ids(session):
             script_logger.warning(" [🟡] No matched IDs found. Nothing to process.")
             with open(FINAL_OUTPUT_FILE, 'w') as f: json.dump([], f)
             return True
-        script_logger.info(f"    -> Found {len(matched_ids)} IDs to process.")
-        all_source_locations, total_ids = [], len(matched_ids)
-        for i, concrete_id in enumerate(matched_ids):
+        total_ids = len(matched_ids)
+
+        progress = checkpoint.get('step3', {}) if checkpoint else {}
+        resolved = set(progress.get('resolved', []))
+        pending_ids = [concrete_id for concrete_id in matched_ids if concrete_id not in resolved]
+        if resolved:
+            script_logger.info(f" [⏩] Resuming: {len(resolved)} IDs already resolved, {len(pending_ids)} left.")
+        script_logger.info(f"    -> Found {len(pending_ids)} IDs to process with {concurrency} workers at up to {rate} req/s.")
+
+        def fetch_one(indexed_id):
+            i, concrete_id = indexed_id
             script_logger.info(f" [🔄] ({i+1}/{total_ids}) Fetching source for ID: {concrete_id[:50]}...")
-            source_data = make_api_request(
+            return make_api_request(
                 session, 'POST', '/bridgecrew/api/v1/sbom/srcs-by-concreteId',
                 json={"concreteId": concrete_id}
             )
-            if source_data is not None:
-                all_source_locations.append({"matchedId": concrete_id, "sourceLocations": source_data})
-            sleep(API_DELAY)
-        with open(FINAL_OUTPUT_FILE, 'w') as f:
-            json.dump(all_source_locations, f, indent=4)
-        script_logger.info(f" [💾] SUCCESS: Saved source locations for {len(all_source_locations)} IDs to '{FINAL_OUTPUT_FILE}'")
+
+        stats, limiter = Throughput(), TokenBucket(rate)
+        resume_at = progress.get('offset') if resolved else None
+        with JsonSink(FINAL_OUTPUT_FILE, 'json', resume_at=resume_at) as sink:
+            # Work in chunks so each finished chunk is on disk and checkpointed before the next starts.
+            for chunk_start in range(0, len(pending_ids), STEP3_CHUNK):
+                chunk = pending_ids[chunk_start:chunk_start + STEP3_CHUNK]
+                offset = len(resolved)
+                results = map_ordered(fetch_one, [(offset + j, concrete_id) for j, concrete_id in enumerate(chunk)],
+                                      workers=concurrency, limiter=limiter, stats=stats)
+                found = [(concrete_id, source_data) for concrete_id, source_data in zip(chunk, results) if source_data is not None]
+                sink.write_many({"matchedId": concrete_id, "sourceLocations": source_data} for concrete_id, source_data in found)
+                resolved.update(concrete_id for concrete_id, _ in found)
+                if checkpoint:
+                    checkpoint.update('step3', resolved=sorted(resolved), offset=sink.tell())
+        summary = stats.summary()
+        script_logger.info(f" [📈] {summary['count']} lookups in {summary['elapsed']:.1f}s "
+                           f"({summary['per_second']:.2f} IDs/sec, p50 {summary['p50']:.3f}s, p95 {summary['p95']:.3f}s)")
+        script_logger.info(f" [💾] SUCCESS: Saved source locations for {len(resolved)} IDs to '{FINAL_OUTPUT_FILE}'")
         return True
     except FileNotFoundError as e:
         script_logger.error(f" [✖︎] FAILED: Prerequisite file not found: '{e.filename}'.")
@@ -179,30 +272,65 @@ def fetch_source_locations_for_ids(session):
 # 🎉 --- MAIN ORCHESTRATOR ---
 # ==============================================================================
 
-if __name__ == "__main__":
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Dependency analysis and source location workflow")
+    parser.add_argument('--dependencies-format', choices=['jsonl', 'json'], default=DEPENDENCIES_FORMAT,
+                        help=f"step 1 output format: compact JSON Lines or the indented JSON array (default: {DEPENDENCIES_FORMAT})")
+    parser.add_argument('--sync', choices=['auto', 'delta', 'skip'], default='auto',
+                        help=f"step 1 against the local index '{DEPENDENCY_DB}': 'delta' refreshes it from the API, "
+                             f"'skip' uses it as is, 'auto' refreshes only if older than {SYNC_MAX_AGE // 3600}h (default: auto)")
+    parser.add_argument('--resume', action='store_true',
+                        help=f"skip work recorded in '{CHECKPOINT_FILE}' and append to the existing outputs")
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY,
+                        help=f"parallel workers for step 3 source lookups (default: {CONCURRENCY})")
+    parser.add_argument('--rate', type=float, default=API_RATE,
+                        help=f"max step 3 requests per second, 0 to disable (default: {API_RATE})")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
     script_logger.info("==========================================================")
     script_logger.info("    DEPENDENCY ANALYSIS AND SOURCE LOCATION WORKFLOW    ")
     script_logger.info("==========================================================")
 
     try:
         script_logger.info(" [🔐] Authenticating and creating API session...")
-        session_managers = session_loader.load_config(file_path=file_path)
-        cspm_session = session_managers[0].create_cspm_session()
+        cspm_session = create_session(args.concurrency)
+        cspm_session.token  # log in now so bad credentials fail here
         script_logger.info("    -> Session created successfully.")
     except Exception as e:
         script_logger.error(f" [✖︎] FATAL: Could not create API session. Check credentials. Error: {e}")
-        exit(1)
+        return 1
 
-    if fetch_all_dependencies(cspm_session):
-        if match_rules_to_dependencies():
-            if fetch_source_locations_for_ids(cspm_session):
+    if args.resume:
+        checkpoint = Checkpoint.load(CHECKPOINT_FILE)
+        script_logger.info(f" [⏩] Resuming from checkpoint '{CHECKPOINT_FILE}'.")
+    else:
+        checkpoint = Checkpoint(CHECKPOINT_FILE)
+        checkpoint.reset()
+
+    succeeded = False
+    dependencies_file = f'cas_dependencies.{args.dependencies_format}'
+    store = DependencyStore(DEPENDENCY_DB)
+    if fetch_all_dependencies(cspm_session, dependencies_file, args.dependencies_format, checkpoint, store, args.sync):
+        if match_rules_to_dependencies(dependencies_file, checkpoint, store):
+            if fetch_source_locations_for_ids(cspm_session, args.concurrency, args.rate, checkpoint):
                 script_logger.info("\n==========================================================")
                 script_logger.info(f" [🎉] WORKFLOW COMPLETED SUCCESSFULLY!")
                 script_logger.info(f"      Final results are in '{FINAL_OUTPUT_FILE}'")
                 script_logger.info("==========================================================")
+                succeeded = True
             else:
                 script_logger.error("\n [💥] Workflow failed at Step 3: Fetching source locations.")
         else:
             script_logger.error("\n [💥] Workflow failed at Step 2: Matching rules.")
     else:
         script_logger.error("\n [💥] Workflow failed at Step 1: Fetching dependencies.")
+
+    log_endpoint_stats(cspm_session)
+    return 0 if succeeded else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+"""
+Version-range matching of SBOM rules against the dependency inventory.
+
+Dependencies are indexed by package name. The versions of a package are parsed and
+sorted once (per version scheme), and each rule's minVersionInclusive/maxVersionInclusive
+range is then resolved with two binary searches, so matching R rules against D
+dependencies costs O((R + D) log D).
+"""
+import re
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+
+# Rule 'type' -> version scheme used to order that package's versions
+SCHEMES = {
+    'nodejs': 'semver', 'npm': 'semver', 'javascript': 'semver', 'yarn': 'semver',
+    'python': 'pep440', 'pypi': 'pep440', 'pip': 'pep440',
+}
+
+# Versions that carry no ordering information and never fall inside a range
+MISSING_VERSIONS = {None, '', 'N/A'}
+
+SEMVER_RE = re.compile(r'^[v=]?(\d+(?:\.\d+)*)(?:-([0-9A-Za-z.-]+))?(?:\+[0-9A-Za-z.-]+)?$')
+PEP440_RE = re.compile(
+    r'^v?(?:(?P<epoch>\d+)!)?(?P<release>\d+(?:\.\d+)*)'
+    r'(?:[-_.]?(?P<pre_l>a|b|c|rc|alpha|beta|pre|preview)[-_.]?(?P<pre_n>\d*))?'
+    r'(?:-(?P<post_n1>\d+)|[-_.]?(?P<post_l>post|rev|r)[-_.]?(?P<post_n2>\d*))?'
+    r'(?:[-_.]?(?P<dev_l>dev)[-_.]?(?P<dev_n>\d*))?'
+    r'(?:\+[a-z0-9]+(?:[-_.][a-z0-9]+)*)?$',
+    re.IGNORECASE,
+)
+PEP440_PRE = {'a': 0, 'alpha': 0, 'b': 1, 'beta': 1, 'c': 2, 'rc': 2, 'pre': 2, 'preview': 2}
+
+
+def _release(text):
+    # 1.2 == 1.2.0 in both semver ranges and PEP 440
+    parts = [int(p) for p in text.split('.')]
+    while len(parts) > 1 and parts[-1] == 0:
+        parts.pop()
+    return tuple(parts)
+
+
+def _generic_key(version):
+    tokens = re.findall(r'\d+|[A-Za-z]+', version)
+    return (0, tuple((1, int(t)) if t.isdigit() else (0, t.lower()) for t in tokens))
+
+
+def _semver_key(version):
+    m = SEMVER_RE.match(version.strip())
+    if not m:
+        return _generic_key(version)
+    release, prerelease = m.groups()
+    if prerelease is None:
+        pre = (1,)
+    else:
+        # A prerelease sorts before its release; numeric identifiers sort before alphanumeric ones.
+        pre = (0,) + tuple((0, int(p), '') if p.isdigit() else (1, 0, p) for p in prerelease.split('.'))
+    return (1, _release(release), pre)
+
+
+def _pep440_key(version):
+    m = PEP440_RE.match(version.strip())
+    if not m:
+        return _generic_key(version)
+    g = m.groupdict()
+    post_n = g['post_n1'] or g['post_n2']
+    has_post = g['post_n1'] is not None or g['post_l'] is not None
+    if g['pre_l']:
+        pre = (0, PEP440_PRE[g['pre_l'].lower()], int(g['pre_n'] or 0))
+    elif g['dev_l'] and not has_post:
+        pre = (-1,)  # 1.0.dev1 < 1.0a1
+    else:
+        pre = (1,)
+    post = (1, int(post_n or 0)) if has_post else (0,)
+    dev = (0, int(g['dev_n'] or 0)) if g['dev_l'] else (1,)
+    return (1, int(g['epoch'] or 0), _release(g['release']), pre, post, dev)
+
+
+PARSERS = {'semver': _semver_key, 'pep440': _pep440_key, 'generic': _generic_key}
+
+
+def version_key(version, scheme='generic'):
+    """Sortable key for `version` under the given scheme ('semver', 'pep440' or 'generic')."""
+    return PARSERS.get(scheme, _generic_key)(str(version))
+
+
+def scheme_for(rule_type):
+    return SCHEMES.get((rule_type or '').lower(), 'generic')
+
+
+class DependencyIndex:
+    """Dependencies grouped by package name, with per-scheme sorted version lists built on demand."""
+
+    def __init__(self):
+        self._by_name = defaultdict(list)
+        self._sorted = {}
+
+    def add(self, name, version, dep_id):
+        if version in MISSING_VERSIONS or dep_id is None:
+            return
+        self._by_name[name].append((version, dep_id))
+        self._sorted.pop(name, None)
+
+    def __len__(self):
+        return sum(len(versions) for versions in self._by_name.values())
+
+    def _sorted_for(self, name, scheme):
+        cached = self._sorted.setdefault(name, {})
+        if scheme not in cached:
+            entries = sorted((version_key(version, scheme), dep_id) for version, dep_id in self._by_name.get(name, ()))
+            cached[scheme] = ([key for key, _ in entries], [dep_id for _, dep_id in entries])
+        return cached[scheme]
+
+    def match(self, package, min_version=None, max_version=None, rule_type=None):
+        """IDs of `package` dependencies whose version lies in [min_version, max_version]; a missing bound is open."""
+        if package not in self._by_name:
+            return []
+        scheme = scheme_for(rule_type)
+        keys, ids = self._sorted_for(package, scheme)
+        lo = 0 if min_version in MISSING_VERSIONS else bisect_left(keys, version_key(min_version, scheme))
+        hi = len(keys) if max_version in MISSING_VERSIONS else bisect_right(keys, version_key(max_version, scheme))
+        return ids[lo:hi]
+
+
+def match_rules(index, rules):
+    """Matched dependency IDs for all rules, de-duplicated, in rule order."""
+    matched, seen = [], set()
+    for rule in rules:
+        for dep_id in index.match(rule.get('package'), rule.get('minVersionInclusive'),
+                                  rule.get('maxVersionInclusive'), rule.get('type')):
+            if dep_id not in seen:
+                seen.add(dep_id)
+                matched.append(dep_id)
+    return matched
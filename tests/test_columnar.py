@@ -0,0 +1,52 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+pa = pytest.importorskip('pyarrow')
+import pyarrow.parquet as pq
+
+from pc_common.columnar import ColumnarSink
+
+COLUMNS = ['image', 'cluster', 'infra']
+ROWS = [
+    {'image': 'nginx', 'cluster': 'a', 'infra': True},
+    {'image': 'redis', 'cluster': '', 'infra': False},
+    {'image': 'nginx', 'cluster': 'b', 'infra': None},
+    {'image': 'postgres', 'cluster': 'a', 'infra': True},
+    {'image': 'mysql', 'cluster': 'c', 'infra': False},
+    {'image': 'redis', 'cluster': 'b', 'infra': True},
+    {'image': 'nginx', 'cluster': 'd', 'infra': False},
+]
+
+
+def write(path, fmt):
+    # batch_rows=3 flushes three batches, each bringing new dictionary values
+    with ColumnarSink(path, COLUMNS, fmt=fmt, dictionary_columns=['image', 'cluster'],
+                      bool_columns=['infra'], batch_rows=3) as sink:
+        for row in ROWS:
+            sink.write_many([row])
+    return sink
+
+
+def expected():
+    return {
+        'image': [row['image'] for row in ROWS],
+        'cluster': [row['cluster'] or None for row in ROWS],
+        'infra': [row['infra'] for row in ROWS],
+    }
+
+
+def test_arrow_file_with_several_batches(tmp_path):
+    sink = write(str(tmp_path / 'out.arrow'), 'arrow')
+    table = pa.ipc.open_file(sink.path).read_all()
+    assert sink.count == len(ROWS)
+    assert table.num_rows == len(ROWS)
+    assert table.to_pydict() == expected()
+
+
+def test_parquet_with_several_batches(tmp_path):
+    sink = write(str(tmp_path / 'out.parquet'), 'parquet')
+    table = pq.read_table(sink.path)
+    assert table.to_pydict() == expected()
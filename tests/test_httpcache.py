@@ -0,0 +1,95 @@
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+pytest.importorskip('requests')
+
+from pc_common import PrismaClient, ResponseCache
+
+LISTING = 'code/api/v2/repositories'
+
+
+class FakePrisma(BaseHTTPRequestHandler):
+    """Serves a repository listing; DELETE bridgecrew/api/v2/repositories/{id} removes one."""
+
+    repositories = []
+    gets = 0
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, body):
+        body = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.reply({'token': 'token'})
+
+    def do_GET(self):
+        type(self).gets += 1
+        self.reply({'repositories': self.repositories})
+
+    def do_DELETE(self):
+        repository_id = self.path.rsplit('/', 1)[1]
+        type(self).repositories = [r for r in self.repositories if r['id'] != repository_id]
+        self.reply({})
+
+
+@pytest.fixture
+def client(tmp_path):
+    FakePrisma.repositories = [{'id': '1'}, {'id': '2'}]
+    FakePrisma.gets = 0
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakePrisma)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = PrismaClient(f'http://127.0.0.1:{server.server_port}', 'user', 'password',
+                          cache=ResponseCache(str(tmp_path / 'cache.db')))
+    yield client
+    client.close()
+    server.shutdown()
+
+
+def repository_ids(client):
+    return [r['id'] for r in client.get(LISTING).json()['repositories']]
+
+
+def test_listing_is_served_from_cache(client):
+    assert repository_ids(client) == ['1', '2']
+    assert repository_ids(client) == ['1', '2']
+    assert FakePrisma.gets == 1
+
+
+@pytest.mark.parametrize('endpoint', [
+    'bridgecrew/api/v2/repositories/1',  # deleted through another API than the listing
+    'code/api/v2/repositories/1',        # below the listing
+])
+def test_delete_then_list_refetches(client, endpoint):
+    assert repository_ids(client) == ['1', '2']
+    assert client.delete(endpoint).ok
+    assert repository_ids(client) == ['2']
+    assert FakePrisma.gets == 2
+
+
+@pytest.mark.parametrize('method, path, dropped', [
+    ('DELETE', 'bridgecrew/api/v2/repositories/1', True),
+    ('PUT', 'bridgecrew/api/v2/repositories/1', True),
+    ('POST', 'bridgecrew/api/v1/vcs-repository/repositories', False),
+    ('PUT', 'user/role/1', False),
+])
+def test_invalidate_follows_the_map(tmp_path, method, path, dropped):
+    cache = ResponseCache(str(tmp_path / 'cache.db'))
+    with cache.conn:
+        cache.conn.execute("INSERT INTO responses (key, path, status, headers, body, stored, used, size) "
+                           "VALUES ('listing', ?, 200, '{}', x'', 0, 0, 0)", (LISTING,))
+    cache.invalidate(path, method)
+    assert (cache.lookup('listing') is None) == dropped
+    cache.close()
@@ -0,0 +1,143 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sbom'))
+
+from version_match import DependencyIndex, match_rules, scheme_for, version_key
+
+# (scheme, lower, higher): version_key(lower) < version_key(higher)
+ORDERED = [
+    # semver: numeric parts compare as numbers
+    ('semver', '1.9.0', '1.10.0'),
+    ('semver', '0.9.9', '1.0.0'),
+    # semver: a prerelease sorts before its release, identifiers compare field by field
+    ('semver', '1.0.0-alpha', '1.0.0-alpha.1'),
+    ('semver', '1.0.0-alpha.1', '1.0.0-alpha.beta'),
+    ('semver', '1.0.0-alpha.beta', '1.0.0-beta'),
+    ('semver', '1.0.0-beta.2', '1.0.0-beta.11'),
+    ('semver', '1.0.0-rc.1', '1.0.0'),
+    ('semver', '1.0.0', '1.0.1-alpha'),
+    # semver: a version that doesn't parse sorts below every one that does
+    ('semver', 'latest', '0.0.1'),
+    # PEP 440: dev < pre < release < post, and the epoch outranks the release
+    ('pep440', '1.0.dev1', '1.0a1'),
+    ('pep440', '1.0a1.dev1', '1.0a1'),
+    ('pep440', '1.0a1', '1.0a2'),
+    ('pep440', '1.0a2', '1.0b1'),
+    ('pep440', '1.0b1', '1.0rc1'),
+    ('pep440', '1.0rc1', '1.0'),
+    ('pep440', '1.0', '1.0.post1.dev1'),
+    ('pep440', '1.0.post1.dev1', '1.0.post1'),
+    ('pep440', '1.0.post1', '1.0.1'),
+    ('pep440', '2.0', '1!0.5'),
+    ('pep440', 'not-a-version', '0.0.1'),
+    # generic: numbers as numbers, more tokens after an equal prefix sort higher
+    ('generic', '1.2.9', '1.2.10'),
+    ('generic', '2023-01-05', '2023-11-01'),
+    ('generic', '1.0', '1.0b'),
+]
+
+# (scheme, a, b): version_key(a) == version_key(b)
+EQUAL = [
+    ('semver', '1.2', '1.2.0'),
+    ('semver', 'v1.2.3', '1.2.3'),
+    ('semver', '=1.2.3', '1.2.3'),
+    ('semver', '1.0.0+build.5', '1.0.0'),
+    ('pep440', '1.0.0', '1.0'),
+    ('pep440', '1.0-1', '1.0.post1'),
+    ('pep440', '1.0c1', '1.0rc1'),
+    ('pep440', '1.0ALPHA1', '1.0a1'),
+    ('pep440', '0!1.0', '1.0'),
+    ('pep440', '1.0+ubuntu.1', '1.0'),
+    ('generic', 'R2', 'r2'),
+]
+
+
+@pytest.mark.parametrize('scheme, lower, higher', ORDERED)
+def test_version_order(scheme, lower, higher):
+    assert version_key(lower, scheme) < version_key(higher, scheme)
+
+
+@pytest.mark.parametrize('scheme, a, b', EQUAL)
+def test_equivalent_versions(scheme, a, b):
+    assert version_key(a, scheme) == version_key(b, scheme)
+
+
+@pytest.mark.parametrize('rule_type, scheme', [
+    ('npm', 'semver'), ('NodeJS', 'semver'), ('pypi', 'pep440'), ('Python', 'pep440'),
+    ('maven', 'generic'), (None, 'generic'),
+])
+def test_scheme_for(rule_type, scheme):
+    assert scheme_for(rule_type) == scheme
+
+
+def sample_index():
+    index = DependencyIndex()
+    for dep_id, version in enumerate(['1.0.0-rc.1', '1.0.0', '1.2.0', '1.10.0', '2.0.0'], start=1):
+        index.add('lodash', version, f"npm-{dep_id}")
+    for dep_id, version in enumerate(['1.0.dev1', '1.0rc1', '1.0', '1.0.post1', '1!0.1'], start=1):
+        index.add('requests', version, f"py-{dep_id}")
+    # Versions without ordering information are never indexed
+    index.add('lodash', 'N/A', 'npm-na')
+    index.add('lodash', '', 'npm-empty')
+    index.add('lodash', None, 'npm-none')
+    index.add('lodash', '3.0.0', None)
+    return index
+
+
+# (package, min, max, type, expected IDs)
+RANGES = [
+    # both bounds are inclusive
+    ('lodash', '1.0.0', '1.10.0', 'npm', ['npm-2', 'npm-3', 'npm-4']),
+    ('lodash', '1.0.0', '1.0.0', 'npm', ['npm-2']),
+    # just outside the stored versions on either side
+    ('lodash', '1.0.1', '1.9.9', 'npm', ['npm-3']),
+    ('lodash', '1.2.1', '1.9.9', 'npm', []),
+    # a prerelease lies below its release
+    ('lodash', '1.0.0-alpha', '1.0.0-rc.1', 'npm', ['npm-1']),
+    # missing bounds are open
+    ('lodash', None, '1.0.0', 'npm', ['npm-1', 'npm-2']),
+    ('lodash', '1.10.0', 'N/A', 'npm', ['npm-4', 'npm-5']),
+    ('lodash', '', '', 'npm', ['npm-1', 'npm-2', 'npm-3', 'npm-4', 'npm-5']),
+    # an empty range matches nothing
+    ('lodash', '2.0.0', '1.0.0', 'npm', []),
+    # PEP 440: dev and rc releases below 1.0, post releases above it, epochs above everything
+    ('requests', '1.0', '1.0', 'pypi', ['py-3']),
+    ('requests', '1.0.dev0', '1.0rc1', 'pypi', ['py-1', 'py-2']),
+    ('requests', '1.0', '1.1', 'pypi', ['py-3', 'py-4']),
+    ('requests', '1!0.0', None, 'pypi', ['py-5']),
+    # an unknown package matches nothing
+    ('left-pad', None, None, 'npm', []),
+]
+
+
+@pytest.mark.parametrize('package, min_version, max_version, rule_type, expected', RANGES)
+def test_match_range(package, min_version, max_version, rule_type, expected):
+    assert sample_index().match(package, min_version, max_version, rule_type) == expected
+
+
+def test_match_uses_the_rule_scheme():
+    index = DependencyIndex()
+    index.add('pkg', '1.0.0-rc.1', 'rc')
+    index.add('pkg', '1.0.0', 'release')
+    # Under semver the rc is a prerelease of 1.0.0; the generic scheme sorts it above 1.0.0
+    assert index.match('pkg', None, '1.0.0', 'npm') == ['rc', 'release']
+    assert index.match('pkg', None, '1.0.0', 'maven') == ['release']
+
+
+def test_match_after_adding_more_versions():
+    index = sample_index()
+    assert index.match('lodash', '1.3.0', '1.9.0', 'npm') == []
+    index.add('lodash', '1.5.0', 'npm-6')
+    assert index.match('lodash', '1.3.0', '1.9.0', 'npm') == ['npm-6']
+
+
+def test_match_rules_deduplicates_in_rule_order():
+    rules = [
+        {'package': 'lodash', 'minVersionInclusive': '1.2.0', 'maxVersionInclusive': '2.0.0', 'type': 'npm'},
+        {'package': 'lodash', 'minVersionInclusive': '1.0.0', 'maxVersionInclusive': '1.2.0', 'type': 'npm'},
+        {'package': 'requests', 'minVersionInclusive': '1.0.post1', 'type': 'pypi'},
+    ]
+    assert match_rules(sample_index(), rules) == ['npm-3', 'npm-4', 'npm-5', 'npm-2', 'py-4', 'py-5']
@@ -1,15 +1,28 @@
+import argparse
 import json
 import os
 import sys
 import requests as req
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pc_common import get_client, run_bulk
 
 api = os.getenv('PRISMA_API_URL')
 username = os.getenv('PRISMA_ACCESS_KEY_ID')
 password = os.getenv('PRISMA_SECRET_KEY')
 
-if api is None or username is None or password is None:
-    print('Missing environment variables')
-    sys.exit(1)
+# Provider the input repositories live on; set PRISMA_REPO_SOURCE to another source, or to * for any
+REPO_SOURCE = os.getenv('PRISMA_REPO_SOURCE', 'Github')
+if REPO_SOURCE == '*':
+    REPO_SOURCE = None
+
+# Input lines that match no repository are listed (up to this many) and saved to a file
+UNMATCHED_PREVIEW = 20
+UNMATCHED_FILE = 'unmatched_repos.txt'
+
+# Concurrent tag rule updates in batch (--mapping) mode
+TAG_RULE_WORKERS = 8
+
+YOR_DESCRIPTION = "Unique traceability tag which links between IaC templates and runtime resources"
 
 class Colors:
     RED = '\033[91m'
@@ -20,33 +33,10 @@ class Colors:
 def color_print(text, color):
     print(color + text + Colors.END)
 
-def authenticate():
-    try:
-        payload = {'username': username, 'password': password}
-        headers = {'Content-Type': 'application/json; charset=UTF-8', 'Accept': 'application/json; charset=UTF-8'}
-        result = req.post(f"{api}/login", data=json.dumps(payload), headers=headers, timeout=30)
-        result.raise_for_status()
-        return result.json()['token']
-    except req.exceptions.RequestException as e:
-        print(f"Error: {e}")
-        sys.exit(1)
-
-def create_headers(token):
+def make_request(method, endpoint, payload=None, cache=True):
     try:
-        return {'Content-Type': 'application/json; charset=UTF-8', 'Accept': 'application/json; charset=UTF-8',
-                'x-redlock-auth': token}
-    except Exception as e:
-        print(f"Error: {e}")
-        sys.exit(1)
-
-def make_request(method, endpoint, payload=None):
-    try:
-        token = authenticate()
-        headers = create_headers(token)
-        if method == "GET":
-            result = req.get(f"{api}/{endpoint}", headers=headers, timeout=30)
-        else:
-            result = req.put(f"{api}/{endpoint}", headers=headers, data=json.dumps(payload), timeout=30)
+        # cache=False bypasses the response cache for this request only (--no-cache)
+        result = get_client().request(method, endpoint, payload, cache=cache)
         result.raise_for_status()
         return result
     except req.exceptions.RequestException as e:
@@ -54,55 +44,188 @@ def make_request(method, endpoint, payload=None):
         sys.exit(1)
 
 
-def get_repos(file_path):
-    # Read the input file to get all owner and repository combinations
+def parse_repo_line(line):
+    # (owner, repository), or (None, line) when the line is not in owner/repository form
+    owner, sep, repository = line.partition('/')
+    if not sep or not owner or not repository or '/' in repository:
+        return None, line
+    return owner, repository
+
+"""
+Stream `owner/repository` lines from the input file as (line number, owner, repository).
+Blank lines and # comments are skipped; malformed lines come back with owner None
+"""
+def read_repo_lines(file_path):
     with open(file_path, 'r') as file:
-        lines = [line.strip() for line in file.readlines()]
-    
+        for line_no, line in enumerate(file, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            yield (line_no,) + parse_repo_line(line)
+
+"""
+Index repositories by (source, owner, repository). With no source, the source is left out
+of the key so a line matches the repository on any provider
+"""
+def index_repos(data, source=REPO_SOURCE):
+    index = {}
+    for item in data:
+        key = (item.get('source') if source else None, item.get('owner'), item.get('repository'))
+        index.setdefault(key, []).append(item.get('id'))
+    return index
+
+def fetch_repo_index(source=REPO_SOURCE, cache=True):
     # Make an API request to fetch repository data
-    response = make_request("GET", "code/api/v2/repositories")
+    response = make_request("GET", "code/api/v2/repositories", cache=cache)
     if response.status_code != 200:
         raise Exception("Failed to fetch repositories")
-    data = response.json()['repositories']
-    
-    repo_ids = []
-    # Filter repositories based on the owner, repository, and source
-    for line in lines:
-        owner, repository = line.split('/')
-        for item in data:
-            if item.get('owner') == owner and item.get('repository') == repository and item.get('source') == 'Github':
-                repo_ids.append(item.get('id'))
+    return index_repos(response.json()['repositories'], source)
 
+"""
+Resolve (where, owner, repository) entries to repository IDs with one index lookup each.
+Returns the IDs (in input order, without duplicates) and the (where, line) entries that matched nothing
+"""
+def resolve_repos(index, entries, source=REPO_SOURCE):
+    repo_ids, seen, unmatched = [], set(), []
+    for where, owner, repository in entries:
+        ids = index.get((source or None, owner, repository)) if owner else None
+        if not ids:
+            unmatched.append((where, repository if owner is None else f"{owner}/{repository}"))
+            continue
+        for repo_id in ids:
+            if repo_id not in seen:
+                seen.add(repo_id)
+                repo_ids.append(repo_id)
+    return repo_ids, unmatched
+
+def get_repos(file_path, source=REPO_SOURCE, cache=True):
+    index = fetch_repo_index(source, cache)
+    entries = ((f"line {line_no}", owner, repository) for line_no, owner, repository in read_repo_lines(file_path))
+    repo_ids, unmatched = resolve_repos(index, entries, source)
+    report_unmatched(unmatched, source)
     return repo_ids
 
+"""
+Print the input lines that matched no repository and write the full list to UNMATCHED_FILE
+"""
+def report_unmatched(unmatched, source=REPO_SOURCE):
+    if not unmatched:
+        return
+    where = f"{source} repositories" if source else "repositories"
+    color_print(f"{len(unmatched)} input lines did not match any onboarded {where}", Colors.YELLOW)
+    for line_where, line in unmatched[:UNMATCHED_PREVIEW]:
+        color_print(f"  {line_where}: {line}", Colors.YELLOW)
+    if len(unmatched) > UNMATCHED_PREVIEW:
+        color_print(f"  ... and {len(unmatched) - UNMATCHED_PREVIEW} more", Colors.YELLOW)
+    with open(UNMATCHED_FILE, 'w') as f:
+        f.writelines(f"{line_where}\t{line}\n" for line_where, line in unmatched)
+    color_print(f"Unmatched lines written to {UNMATCHED_FILE}", Colors.YELLOW)
+
+
+def get_tag_rules(cache=True):
+    data = make_request("GET", "code/api/v1/tag-rules", cache=cache)
+    return {item.get('name'): item for item in data.json()}
 
-def get_tagRule_id():
+def get_tagRule_id(cache=True):
     try:
-        data = make_request("GET", "code/api/v1/tag-rules")
-        for item in data.json():
-            if item.get('name') == "yor_trace":
-                return {
-                    "id": item.get('id'),
-                    "name": item.get('name'),
-                    "repositories": item.get('repositories')
-                }
+        item = get_tag_rules(cache).get("yor_trace")
+        if item is not None:
+            return {
+                "id": item.get('id'),
+                "name": item.get('name'),
+                "repositories": item.get('repositories')
+            }
         # If 'specified tag rule' not found, return None
         return None
     except Exception as e:
         print(f"Error: {e}")
         sys.exit(1)
 
+def rule_repo_ids(rule):
+    # A rule's repositories may be listed as IDs or as repository objects
+    return {r.get('id') if isinstance(r, dict) else r for r in rule.get('repositories') or []}
 
+def rule_payload(rule, repos_id):
+    return {
+        "name": rule.get('name'),
+        "description": rule.get('description') or YOR_DESCRIPTION,
+        "repositories": repos_id
+        }
 
-def update_tag_rule():
+"""
+Read the rule -> repositories mapping: a JSON object whose values are lists of
+`owner/repository` strings, or the path of an input file in the input.txt format
+"""
+def load_mapping(mapping_file):
+    with open(mapping_file, 'r') as f:
+        mapping = json.load(f)
+    base = os.path.dirname(os.path.abspath(mapping_file))
+    rules = {}
+    for name, repos in mapping.items():
+        if isinstance(repos, str):
+            path = os.path.join(base, repos)
+            rules[name] = [(f"{name}: {repos} line {line_no}", owner, repository)
+                           for line_no, owner, repository in read_repo_lines(path)]
+        else:
+            rules[name] = [(f"{name}: entry {i}",) + parse_repo_line(line.strip())
+                           for i, line in enumerate(repos, 1) if line.strip()]
+    return rules
+
+"""
+Bring every rule in the mapping file in line with its repository list. Tag rules and
+repositories are fetched once; only rules whose repository set changed are updated,
+concurrently
+"""
+def update_tag_rules(mapping_file, workers=TAG_RULE_WORKERS, dry_run=False, source=REPO_SOURCE, cache=True):
+    mapping = load_mapping(mapping_file)
+    rules = get_tag_rules(cache)
+    index = fetch_repo_index(source, cache)
+
+    changes, unmatched = [], []
+    for name, entries in mapping.items():
+        rule = rules.get(name)
+        if rule is None:
+            color_print(f"Tag rule '{name}' not found", Colors.RED)
+            continue
+        repos_id, missing = resolve_repos(index, entries, source)
+        unmatched.extend(missing)
+        current = rule_repo_ids(rule)
+        added, removed = set(repos_id) - current, current - set(repos_id)
+        if not (added or removed):
+            color_print(f"{name}: unchanged ({len(current)} repositories), skipping", Colors.GREEN)
+            continue
+        color_print(f"{name}: {len(added)} to add, {len(removed)} to remove", Colors.YELLOW)
+        changes.append({"rule": rule, "repositories": repos_id, "added": len(added), "removed": len(removed)})
+    report_unmatched(unmatched, source)
+
+    if dry_run or not changes:
+        print(f"{len(changes)} of {len(mapping)} tag rules would be updated" if dry_run else "No tag rules to update")
+        return None
+
+    # Errors are isolated per rule, so one failed PUT doesn't stop the others
+    client = get_client()
+    report = run_bulk(
+        lambda change: client.put(f"code/api/v1/tag-rules/{change['rule'].get('id')}",
+                                  rule_payload(change['rule'], change['repositories'])),
+        changes, "update tag rules", workers=workers,
+        describe=lambda change: {"rule": change['rule'].get('name'), "added": change['added'],
+                                 "removed": change['removed']},
+        on_result=lambda entry, ok: color_print(
+            f"{entry['rule']}: updated" if ok else f"{entry['rule']}: update failed ({entry['status']} {entry.get('error', '')})",
+            Colors.GREEN if ok else Colors.RED))
+    summary = report.summary()
+    print(f"Updated {summary['succeeded']} of {summary['total']} tag rules, {summary['failed']} failed")
+    return report
+
+def update_tag_rule(cache=True):
     try:
-        tagRule_id = get_tagRule_id()
+        tagRule_id = get_tagRule_id(cache)
         file_path = 'input.txt'
-        repos_id = get_repos(file_path)
+        repos_id = get_repos(file_path, cache=cache)
         print(repos_id)
         payload = {
             "name":"yor_trace",
-            "description":"Unique traceability tag which links between IaC templates and runtime resources",
+            "description":YOR_DESCRIPTION,
             "repositories":repos_id
             }
         result = make_request("PUT", f"code/api/v1/tag-rules/{tagRule_id['id']}", payload)
@@ -112,10 +235,36 @@ def update_tag_rule():
         print(f"Error: {e}")
         color_print('Error updating tag rule', Colors.RED)
 
-if __name__ == '__main__':
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Update Yor tag rule repositories")
+    parser.add_argument('--mapping', help="JSON file mapping tag rule names to repository lists (batch mode)")
+    parser.add_argument('--workers', type=int, default=TAG_RULE_WORKERS,
+                        help="concurrent tag rule updates in batch mode (default: %(default)s)")
+    parser.add_argument('--dry-run', action='store_true', help="batch mode: only print what would change")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="bypass the PRISMA_HTTP_CACHE response cache and query the API directly")
+    args = parser.parse_args(argv)
+
+    if api is None or username is None or password is None:
+        print('Missing environment variables')
+        return 1
+
     color_print('CAS - Update Yor Tag Rule - 0.0.1', Colors.GREEN)
     try:
-        update_tag_rule()
-        color_print('Done', Colors.GREEN)
+        if args.mapping:
+            report = update_tag_rules(args.mapping, args.workers, args.dry_run, cache=not args.no_cache)
+            failed = report is not None and len(report.failed) > 0
+        else:
+            # update_tag_rule reports its own errors and returns None when the update didn't go through
+            failed = update_tag_rule(cache=not args.no_cache) is None
     except Exception as e:
-        color_print(f"Error: {e}", Colors.RED)
\ No newline at end of file
+        color_print(f"Error: {e}", Colors.RED)
+        return 1
+    if failed:
+        color_print('Finished with errors', Colors.RED)
+        return 1
+    color_print('Done', Colors.GREEN)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())